@@ -0,0 +1,205 @@
+"""
+Benchmarks for ComfyUI-Chord, run from the repository root:
+
+    python benchmark.py height --size 1024 --workers 1 2 4 8
+    python benchmark.py startup --comfyui /path/to/ComfyUI
+    python benchmark.py cpu --ckpt /path/to/chord_v1.safetensors --sizes 512 1024
+    python benchmark.py quant --ckpt /path/to/chord_v1.safetensors --images chord/examples/generated
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+chord_dir = os.path.join(current_dir, "chord")
+for path in (chord_dir, current_dir):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import torch
+
+def timed(fn, repeat):
+    fn() # warm-up, fills the spectral and blending caches
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+def bench_height(args):
+    from normal_to_height import normal_to_height
+    torch.manual_seed(0)
+    normal = torch.rand(args.batch, 3, args.size, args.size)
+    print(f"normal_to_height, {args.batch}x{args.size}x{args.size}, mode={args.mode}, "
+          f"torch threads={torch.get_num_threads()}, cpus={os.cpu_count()}")
+    print(f"{'solver':>8} {'workers':>8} {'seconds':>10} {'speedup':>8}")
+    for solver in args.solvers:
+        baseline = None
+        for workers in args.workers:
+            seconds = timed(lambda: normal_to_height(normal, solver=solver, mode=args.mode, workers=workers), args.repeat)
+            baseline = baseline or seconds
+            print(f"{solver:>8} {workers:>8} {seconds:>10.3f} {baseline / seconds:>7.2f}x")
+
+# runs in a fresh interpreter so every measurement pays the real import cost
+STARTUP_SCRIPT = """
+import importlib.util, json, sys, time
+sys.path[:0] = {paths!r}
+# already imported by ComfyUI before it loads custom nodes
+import torch, folder_paths, comfy.model_management, comfy.model_patcher, comfy.utils
+start = time.perf_counter()
+if {with_chord!r}:
+    spec = importlib.util.spec_from_file_location("comfyui_chord", {init_path!r}, submodule_search_locations=[{root!r}])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+registered = time.perf_counter() - start
+if {load_stack!r}:
+    from omegaconf import OmegaConf
+    from chord import ChordModel
+print(json.dumps({{"register": registered, "total": time.perf_counter() - start,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def bench_startup(args):
+    paths = [args.comfyui] if args.comfyui else []
+    cases = [
+        ("without Chord", False, False),
+        ("with Chord", True, False),
+        ("with Chord + model stack", True, True),
+    ]
+    print(f"ComfyUI startup import cost, median of {args.repeat} fresh interpreters")
+    print(f"{'case':>26} {'process s':>10} {'nodes s':>8} {'import s':>9}  heavy modules loaded")
+    for name, with_chord, load_stack in cases:
+        script = STARTUP_SCRIPT.format(
+            paths=paths, with_chord=with_chord, load_stack=load_stack,
+            init_path=os.path.join(current_dir, "__init__.py"), root=current_dir,
+            heavy=["diffusers", "transformers", "omegaconf", "torchvision"],
+        )
+        runs = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+            elapsed = time.perf_counter() - start
+            if result.returncode != 0:
+                sys.exit(f"{name}: interpreter failed, is --comfyui set?\n{result.stderr}")
+            runs.append((elapsed, json.loads(result.stdout.strip().splitlines()[-1])))
+        process = statistics.median(elapsed for elapsed, _ in runs)
+        register = statistics.median(run["register"] for _, run in runs)
+        total = statistics.median(run["total"] for _, run in runs)
+        print(f"{name:>26} {process:>10.3f} {register:>8.3f} {total:>9.3f}  {', '.join(runs[-1][1]['heavy']) or '-'}")
+
+def load_chord(config, ckpt_path):
+    from chord import ChordModel
+    if ckpt_path.endswith(".safetensors"):
+        model = ChordModel.empty(config)
+        model.assign_checkpoint(ckpt_path)
+    else:
+        model = ChordModel(config)
+        model.load_state_dict(torch.load(ckpt_path, map_location="cpu", weights_only=False)["state_dict"])
+    return model.eval()
+
+def bench_cpu(args):
+    from omegaconf import OmegaConf
+    config = OmegaConf.load(os.path.join(chord_dir, "config/chord.yaml"))
+    config.model.stable_diffusion.device = "cpu"
+    config.model.stable_diffusion.cpu_dtype = args.dtype
+    config.model.stable_diffusion.cpu_channels_last = not args.no_channels_last
+    config.model.cpu_threads = args.threads
+    config.model.cpu_interop_threads = args.interop_threads
+    model = load_chord(config, args.ckpt)
+    print(f"Chord on CPU, dtype={model.model.dtype}, channels_last={not args.no_channels_last}, "
+          f"threads={torch.get_num_threads()}/{torch.get_num_interop_threads()}, capability={torch.backends.cpu.get_cpu_capability()}")
+    print(f"{'size':>6} {'batch':>6} {'seconds':>10} {'images/min':>11}")
+    for size in args.sizes:
+        x = torch.rand(args.batch, 3, size, size)
+        def run():
+            with torch.no_grad(), model.autocast("cpu"):
+                model(x)
+        seconds = timed(run, args.repeat)
+        print(f"{size:>6} {args.batch:>6} {seconds:>10.2f} {60 * args.batch / seconds:>11.2f}")
+
+def psnr(a, b):
+    mse = torch.mean((a - b) ** 2).item()
+    return float("inf") if mse == 0 else 10 * torch.log10(torch.tensor(1.0 / mse)).item()
+
+def bench_quant(args):
+    from omegaconf import OmegaConf
+    from torchvision.transforms import v2
+    from chord.io import read_image
+    config = OmegaConf.load(os.path.join(chord_dir, "config/chord.yaml"))
+    config.model.stable_diffusion.cpu_dtype = "bf16"
+    model = load_chord(config, args.ckpt)
+    device = next(model.parameters()).device
+    files = sorted(os.path.join(args.images, f) for f in os.listdir(args.images)
+                   if f.lower().endswith((".png", ".jpg", ".jpeg")))[:args.limit]
+    images = [v2.Resize(size=(args.size, args.size), antialias=True)(read_image(f)[:3]) for f in files]
+
+    def run_all():
+        outputs = []
+        for image in images:
+            with torch.no_grad(), model.autocast(device):
+                output = model(image[None].to(device))
+            outputs.append({key: value.float().clamp(0, 1).cpu() for key, value in output.items()})
+        return outputs
+
+    def weight_bytes():
+        return sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+
+    baseline, baseline_bytes = run_all(), weight_bytes()
+    print(f"int8 weight-only vs {model.model.dtype} baseline, {len(images)} image(s) at {args.size}x{args.size}, "
+          f"baseline weights {baseline_bytes / 2**30:.2f} GiB")
+    print(f"{'variant':>14} {'GiB':>6} {'map':>10} {'mae':>8} {'max':>8} {'psnr dB':>8}")
+    # the second variant quantises the VAE decoder on top of the already quantised UNet
+    for variant, vae_decoder in (("int8_unet", False), ("int8_unet_vae", True)):
+        model.model.sd.quantize(vae_decoder=vae_decoder)
+        outputs = run_all()
+        for key in ("basecolor", "normal", "roughness", "metalness"):
+            diff = torch.cat([(o[key] - b[key]).abs().flatten() for o, b in zip(outputs, baseline)])
+            score = sum(psnr(o[key], b[key]) for o, b in zip(outputs, baseline)) / len(images)
+            print(f"{variant:>14} {weight_bytes() / 2**30:>6.2f} {key:>10} {diff.mean().item():>8.4f} "
+                  f"{diff.max().item():>8.4f} {score:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="ComfyUI-Chord benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    height = subparsers.add_parser("height", help="CPU scaling of normal_to_height across worker counts")
+    height.add_argument("--size", type=int, default=1024)
+    height.add_argument("--batch", type=int, default=1)
+    height.add_argument("--mode", default="tiled")
+    height.add_argument("--solvers", nargs="+", default=["fft", "rfft", "scipy"])
+    height.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    height.add_argument("--repeat", type=int, default=3)
+    height.set_defaults(func=bench_height)
+
+    startup = subparsers.add_parser("startup", help="Import cost of registering the Chord nodes at ComfyUI startup")
+    startup.add_argument("--comfyui", default=os.environ.get("COMFYUI_PATH"), help="ComfyUI root, for folder_paths and comfy")
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+
+    cpu = subparsers.add_parser("cpu", help="Images per minute of the full Chord chain on CPU")
+    cpu.add_argument("--ckpt", required=True, help="Chord checkpoint (.safetensors or .ckpt)")
+    cpu.add_argument("--sizes", type=int, nargs="+", default=[512, 1024])
+    cpu.add_argument("--batch", type=int, default=1)
+    cpu.add_argument("--dtype", choices=["auto", "bf16", "fp32"], default="auto")
+    cpu.add_argument("--no-channels-last", action="store_true")
+    cpu.add_argument("--threads", type=int, default=0)
+    cpu.add_argument("--interop-threads", type=int, default=0)
+    cpu.add_argument("--repeat", type=int, default=2)
+    cpu.set_defaults(func=bench_cpu)
+
+    quant = subparsers.add_parser("quant", help="Accuracy of the int8 quantised model against the bf16 baseline")
+    quant.add_argument("--ckpt", required=True, help="Chord checkpoint (.safetensors or .ckpt)")
+    quant.add_argument("--images", default=os.path.join(chord_dir, "examples/generated"))
+    quant.add_argument("--limit", type=int, default=8)
+    quant.add_argument("--size", type=int, default=1024)
+    quant.set_defaults(func=bench_quant)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
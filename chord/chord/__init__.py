@@ -1,14 +1,75 @@
+import copy
+import contextlib
 import torch
 import torch.nn as nn
+from safetensors import safe_open
 from .module import make
+from .runtime import inference_autocast
 from .module.chord import post_decoder
 
+@contextlib.contextmanager
+def init_empty_weights():
+    '''
+    Parameters registered inside the context are moved to the meta device, so building
+    the modules neither allocates nor randomly initialises weights. Buffers stay real,
+    some of them (e.g. the CLIP position ids) are not stored in checkpoints.
+    '''
+    register_parameter = nn.Module.register_parameter
+    def register_empty_parameter(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            param = module._parameters[name]
+            module._parameters[name] = type(param)(param.to("meta"), requires_grad=param.requires_grad)
+    nn.Module.register_parameter = register_empty_parameter
+    try:
+        yield
+    finally:
+        nn.Module.register_parameter = register_parameter
+
 class ChordModel(nn.Module):
     def __init__(self, config):
         super().__init__()
         self.model = make(config.model.name, config.model)
 
-    def forward(self, x: torch.Tensor):
+    @classmethod
+    def empty(cls, config):
+        '''
+        Model whose parameters live on the meta device, to be filled by assign_checkpoint.
+        '''
+        config = copy.deepcopy(config)
+        config.model.stable_diffusion.empty_weights = True
+        with init_empty_weights():
+            return cls(config)
+
+    def assign_checkpoint(self, ckpt_path, device=None):
+        '''
+        Assign every tensor straight from the memory-mapped safetensors checkpoint, cast
+        to the dtype of the parameter it replaces, so loading holds about one copy of the
+        weights.
+        '''
+        device = device or self.model.device
+        expected = self.state_dict()
+        skip_text_encoder = self.model.sd.text_encoder is None
+        state = {}
+        with safe_open(ckpt_path, framework="pt", device=str(device)) as f:
+            for key in f.keys():
+                if skip_text_encoder and ".sd.text_encoder." in key:
+                    continue
+                tensor = f.get_tensor(key)
+                if key in expected and tensor.is_floating_point():
+                    tensor = tensor.to(expected[key].dtype)
+                    # keep the channels_last layout of the CPU profile
+                    if tensor.dim() == 4 and expected[key].is_contiguous(memory_format=torch.channels_last):
+                        tensor = tensor.contiguous(memory_format=torch.channels_last)
+                state[key] = tensor
+        self.load_state_dict(state, assign=True)
+        return self.to(device)
+
+    def autocast(self, device=None):
+        # fp16 autocast on CUDA, the model's own dtype on CPU (bf16 or none)
+        return inference_autocast(device or next(self.parameters()).device, self.model.dtype)
+
+    def forward(self, x: torch.Tensor, outputs=None, decode="per_step", return_latents=False):
         x = {"render": x}
-        pred = self.model(x)
-        return post_decoder(pred)
\ No newline at end of file
+        pred = self.model(x, outputs, decode, return_latents)
+        return post_decoder(pred)
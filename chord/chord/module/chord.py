@@ -1,4 +1,6 @@
 import copy
+import math
+import hashlib
 import torch
 from torch import nn
 import torch.nn.functional as Fn
@@ -7,6 +9,7 @@ from torchvision.transforms import v2
 from . import register, make
 from .base import Base
 
+from ..runtime import configure_cpu_threads
 from ..util import fresnelSchlick, GeometrySchlickGGX, DistributionGGX
 from ..util import srgb_to_rgb, tone_gamma, get_positions, safe_01_div
 
@@ -24,6 +27,50 @@ def post_decoder(out_dict):
         else: out[key] = out_dict[key]
     return out
 
+def median_filter2d(x, kernel_size, max_patch_elements=2**26, levels_per_chunk=16):
+    """
+    Median over kernel_size x kernel_size windows of a reflect-padded map.
+
+    Small inputs use the exact unfold + torch.median path, chunked over the batch so
+    that each chunk unfolds at most max_patch_elements values. When the unfolded patch
+    tensor of a single sample (kernel_size^2 x H x W values) would exceed
+    max_patch_elements, values are
+    quantised to 8 bits and the median is read off per-level window counts instead:
+    the median is the number of levels t whose count of window values <= t is below
+    the median rank. Counts come from integral images, so memory stays at
+    levels_per_chunk x H x W regardless of the kernel size; the result equals the
+    exact median rounded to the nearest level.
+
+    Args:
+        x (torch.Tensor): Input tensor (B, 1, H, W) with values in [0, 255].
+        kernel_size (int): Odd window size.
+
+    Returns:
+        torch.Tensor: Median filtered tensor (B, 1, H, W).
+    """
+    pad = kernel_size // 2
+    padded = Fn.pad(x, (pad,) * 4, mode="reflect")  # Pad for edge handling
+    # decided per sample, so the result does not depend on the batch size
+    patch_elements = kernel_size ** 2 * x[0].numel()
+    if patch_elements <= max_patch_elements:
+        chunk = max(1, max_patch_elements // patch_elements)
+        return torch.cat([
+            torch.median(Fn.unfold(p, kernel_size), dim=1).values  # Median of patches
+            for p in padded.split(chunk)
+        ]).view(x.shape)
+
+    quantised = padded.round().clamp(0, 255).to(torch.uint8)
+    rank = (kernel_size ** 2 - 1) // 2 + 1  # torch.median returns the lower median
+    median = torch.zeros(x.shape, dtype=torch.int32, device=x.device)
+    k = kernel_size
+    for start in range(0, 255, levels_per_chunk):
+        levels = torch.arange(start, min(start + levels_per_chunk, 255), device=x.device, dtype=torch.uint8)
+        below = (quantised[None] <= levels.view(-1, 1, 1, 1, 1)).to(torch.int32)
+        integral = Fn.pad(below.cumsum(-1).cumsum(-2), (1, 0, 1, 0))
+        counts = integral[..., k:, k:] - integral[..., :-k, k:] - integral[..., k:, :-k] + integral[..., :-k, :-k]
+        median += (counts < rank).sum(0, dtype=torch.int32)
+    return median.to(x.dtype)
+
 def process_irradiance(radiance, kernel_size=25, res=64):
     """
     Process the irradiance using PyTorch, equivalent to the original OpenCV-based function.
@@ -52,56 +99,50 @@ def process_irradiance(radiance, kernel_size=25, res=64):
     radiance = torch.clamp(radiance * 255, 0, 255)  # Remove batch/channel dims
 
     # Apply median filtering
-    paded_radiance = Fn.pad(radiance, (kernel_size // 2,) * 4, mode="reflect")  # Pad for edge handling
-    unfolded = Fn.unfold(paded_radiance, kernel_size)  # Extract patches
-    radiance = torch.median(unfolded, dim=1).values.view(radiance.shape)  # Median of patches
+    radiance = median_filter2d(radiance, kernel_size)
 
     # Normalize to [0, 1]
     rad_min, rad_max = radiance.amin([2,3], keepdim=True), radiance.amax([2,3], keepdim=True)
     radiance = (radiance - rad_min) / (rad_max - rad_min)
     return radiance
 
-def opt_light_dir(_radiance, _num_samples=6):
+def opt_light_dir(_radiance, _num_samples=6, _resolution=torch.pi/90):
     '''
         _radiance: (bs, 1, h, w)
+        returns: (bs, 2) in-plane light direction of every sample
     '''
     assert _radiance.shape[1] == 1 and _radiance.dim()==4
     bs, _, h, w = _radiance.shape
 
-    def evenly_sample(_num_samples, min=0, max=2*torch.pi):
-        # returns torch.tensor([1, _num_samples])
-        return torch.tensor(range(_num_samples+1)) * (max - min) / _num_samples + min
-
     def compute_radiance_diff(angles):
-        num = angles.shape[-1]
-        dirs = torch.cat([torch.cos(angles), torch.sin(angles)]).T
-        pos_dir = grid_pos.repeat(num, 1, 1, 1)
-        pos_mask = torch.einsum("abcd,ad->abc", pos_dir, dirs) > 0
-        neg_mask = torch.einsum("abcd,ad->abc", pos_dir, dirs) < 0
-        samples_radiance = _radiance.repeat(1,num,1,1)
-        radiance_diff = (samples_radiance*pos_mask[None] - samples_radiance*neg_mask[None]).sum([2,3])
-        return radiance_diff
-    
-    angle_min, angle_max = 0, 2*torch.pi
+        # angles: (bs, num) -> radiance on the lit side minus the shadowed side, (bs, num)
+        dirs = torch.stack([torch.cos(angles), torch.sin(angles)], dim=-1)
+        side = torch.sign(torch.einsum("hwc,bnc->bnhw", grid_pos, dirs))
+        return torch.einsum("bhw,bnhw->bn", _radiance[:, 0], side)
+
     grid_pos = Fn.normalize(get_positions(h,w,10)[...,:2], dim=-1, eps=1e-6).to(_radiance)
-    while(((angle_max - angle_min) > (torch.pi/90))):
-        angles = evenly_sample(_num_samples, angle_min, angle_max)[None].to(_radiance)
-        diffs = compute_radiance_diff(angles).mean(0)
-        angle_min = angles[:,diffs.argmax()].item() - (angle_max - angle_min)/_num_samples
-        angle_max = angles[:,diffs.argmax()].item() + (angle_max - angle_min)/_num_samples
+    steps = torch.arange(_num_samples+1, device=_radiance.device, dtype=_radiance.dtype) / _num_samples
+    angle_min = torch.zeros(bs, 1, device=_radiance.device, dtype=_radiance.dtype)
+    angle_range = 2*torch.pi
+    # every step narrows the search window around the best angle by a factor of _num_samples/2,
+    # a fixed step count keeps the loop free of host syncs
+    num_steps = max(1, math.ceil(math.log(2*torch.pi/_resolution) / math.log(_num_samples/2)))
+    for _ in range(num_steps):
+        angles = angle_min + steps * angle_range
+        best = torch.gather(angles, 1, compute_radiance_diff(angles).argmax(dim=1, keepdim=True))
+        angle_range = 2 * angle_range / _num_samples
+        angle_min = best - angle_range / 2
 
-    light_angle = angles[:, diffs.argmax()]
-    return torch.tensor([torch.cos(light_angle), torch.sin(light_angle)]).to(_radiance)
+    light_angle = best[:, 0]
+    return torch.stack([torch.cos(light_angle), torch.sin(light_angle)], dim=-1)
 
 
-def find_light_dir(raw_irradiance, light):
+def find_light_dir(raw_irradiance, light, res=64, kernel_size=25):
     raw_irradiance = v2.functional.rgb_to_grayscale(raw_irradiance)
-    irradiance = process_irradiance(raw_irradiance)
+    irradiance = process_irradiance(raw_irradiance, kernel_size=kernel_size, res=res)
     dir = opt_light_dir(irradiance)
-    dir = torch.cat([dir, torch.tensor([0.5**0.5]).to(dir)])
-    _light = copy.deepcopy(light)
-    _light.direction = dir
-    return _light
+    dir = torch.cat([dir, torch.full_like(dir[:, :1], 0.5**0.5)], dim=-1)
+    return light.with_direction(dir)
 
 @register("chord")
 class Chord(Base):
@@ -112,6 +153,12 @@ class Chord(Base):
         self.prompts = self.config.get("rgbx_prompts", {})
         self.roughness_step = self.config.get("roughness_step", 10)
         self.metallic_step = self.config.get("metallic_step", 0.2)
+        # "exhaustive", "factorized" or "coarse_to_fine", see compute_approxRouMet
+        self.approxRM_search = self.config.get("approxRM_search", "exhaustive")
+        self.approxRM_coarse_stride = self.config.get("approxRM_coarse_stride", 4)
+        self.approxRM_memory_budget = self.config.get("approxRM_memory_budget", 2048)
+        self.irradiance_res = self.config.get("irradiance_res", 64)
+        self.irradiance_kernel_size = self.config.get("irradiance_kernel_size", 25)
 
         self.sd = make(self.config.stable_diffusion.name, self.config.stable_diffusion)
         self.dtype = self.sd.dtype
@@ -124,19 +171,25 @@ class Chord(Base):
         self.sd.unet.LastUpBlocks = nn.ModuleDict()
         for key in list(set("_".join(self.chain.values()).split("_"))) + ["noise"]:
             if "0" in key or "1" in key: continue
-            self.sd.unet.ConvIns[key] = nn.Conv2d(4, 320, 3, 1 , 1, device=self.device, dtype=self.dtype)
+            self.sd.unet.ConvIns[key] = nn.Conv2d(4, 320, 3, 1 , 1, device=self.sd.init_device, dtype=self.dtype)
             self.sd.unet.ConvIns[key].load_state_dict(self.sd.unet.conv_in.state_dict())
         for kout in list(set(self.chain.keys())):
-            self.sd.unet.ConvOuts[kout] = nn.Conv2d(320, 4, 3, 1 , 1, device=self.device, dtype=self.dtype)
+            self.sd.unet.ConvOuts[kout] = nn.Conv2d(320, 4, 3, 1 , 1, device=self.sd.init_device, dtype=self.dtype)
             self.sd.unet.ConvOuts[kout].load_state_dict(self.sd.unet.conv_out.state_dict())
-            self.sd.unet.LastUpBlocks[kout] = copy.deepcopy(self.sd.unet.up_blocks[-1]).to(self.device)
-            self.sd.unet.FirstDownBlocks[kout] = copy.deepcopy(self.sd.unet.down_blocks[0]).to(self.device)
+            self.sd.unet.LastUpBlocks[kout] = copy.deepcopy(self.sd.unet.up_blocks[-1]).to(self.sd.init_device)
+            self.sd.unet.FirstDownBlocks[kout] = copy.deepcopy(self.sd.unet.down_blocks[0]).to(self.sd.init_device)
         self.sd.unet.ConvIns.train()
         self.sd.unet.ConvOuts.train()
         self.sd.unet.FirstDownBlocks.train()
         self.sd.unet.LastUpBlocks.train()
         self.sd.unet.conv_in = dummy_module()
         self.sd.unet.conv_out = dummy_module()
+        if self.sd.channels_last:
+            self.sd.to_channels_last()
+        threads, interop_threads = self.config.get("cpu_threads", 0), self.config.get("cpu_interop_threads", 0)
+        # thread counts are process-wide, leave them alone unless the config asks for some
+        if self.device.type == "cpu" and (threads > 0 or interop_threads > 0):
+            configure_cpu_threads(threads, interop_threads)
 
         # Load Lights
         if self.config.get("prior_light", None) is None:
@@ -150,12 +203,48 @@ class Chord(Base):
     def compute_approxIrr(self, render, basecolor):
         approxIrr = safe_01_div.apply(srgb_to_rgb(render), srgb_to_rgb(basecolor))
         return tone_gamma(approxIrr)
+    def approxRM_chunk_size(self, bs, h, w, itemsize):
+        '''
+            Number of grid candidates rendered at once by the exhaustive approxRM search,
+            derived from approxRM_memory_budget (MB) and the size of one candidate's
+            compute_render intermediates (about ten bs x h x w x 3 buffers).
+        '''
+        per_candidate = 10 * bs * h * w * 3 * itemsize
+        return max(1, int(self.approxRM_memory_budget * 1024 ** 2) // per_candidate)
+
+    def estimate_sample_memory(self, h, w):
+        '''
+            Rough peak device memory of forward at h x w, in bytes, split into a part shared
+            by the whole batch (the exhaustive approxRM chunk budget) and a part per sample.
+            The UNet, VAE and approxRM stages run one after another, so a sample only pays
+            for the largest of them on top of the float32 maps kept across the chain.
+        '''
+        itemsize = torch.finfo(self.dtype).bits // 8
+        vae_h, vae_w = h, w
+        if self.sd.use_vae_tiling(h, w):
+            vae_h, vae_w = min(h, self.sd.vae_tile_size), min(w, self.sd.vae_tile_size)
+        # VAE decoder: 256-channel upsampled features at full resolution, a few live at once
+        vae = 4 * 256 * vae_h * vae_w * itemsize
+        # UNet: 320-channel blocks at latent resolution plus the skip connections of the down path
+        unet = 24 * 320 * (h // 8) * (w // 8) * itemsize
+        if self.approxRM_search == "exhaustive":
+            fixed = int(self.approxRM_memory_budget * 1024 ** 2)
+            search = 10 * h * w * 3 * 4 # at least one candidate per sample
+        else:
+            fixed = 0
+            num_metallic = round(1 / self.metallic_step) + 1
+            search = (2 * num_metallic + 4) * h * w * 3 * 4 # base/spec stacks and render terms
+        # render, decoded maps, intermediate representations and their latents
+        maps = 8 * h * w * 3 * 4
+        return fixed, maps + max(vae, unet, search)
+
     # Eq.6
     @torch.no_grad()
     def compute_approxRouMet(self, render, maps, seperate=False, light=None):
         render = srgb_to_rgb(render)
         bs, _, h, w = render.shape
-        light = find_light_dir(maps['approxIrr'], self.prior_light) if light is None else light
+        if light is None:
+            light = find_light_dir(maps['approxIrr'], self.prior_light, self.irradiance_res, self.irradiance_kernel_size)
         # light.direction = estimate_light_dir(render, maps)
         pos = get_positions(h, w, 10).to(self.device)
         cameras = torch.tensor([0, 0, 10.0]).to(self.device)
@@ -164,29 +253,34 @@ class Chord(Base):
         r_samples = torch.arange(25, 225+self.roughness_step, self.roughness_step) / 255
         m_samples = torch.arange(0., 1.+self.metallic_step, self.metallic_step)
 
-        grid_maps = {} # change map size into: gs, bs, h, w, c
-        grid_maps['basecolor'] = maps['basecolor'][None].permute(0,1,3,4,2)
-        grid_maps['normal'] = maps['normal'][None].permute(0,1,3,4,2)
-        r_values = r_samples[:,None].repeat(1,len(m_samples)).reshape(-1,1,1,1,1).to(maps['basecolor'])
-        m_values = m_samples[None].repeat(len(r_samples),1).reshape(-1,1,1,1,1).to(maps['basecolor'])
-        # split into chunks to avoid OOM
-        chunk_size = 25
-        rgb_list, r_list, m_list = [], [], []
-        for _r, _m in zip(torch.split(r_values, chunk_size), torch.split(m_values, chunk_size)):
-            grid_maps['roughness'], grid_maps['metallic'] = _r, _m
-            _rgb = self.compute_render(grid_maps, cameras, pos, light)
-            loss = (render[None].permute(0,1,3,4,2) - _rgb).abs().sum(-1,keepdim=True)
-            min_idx = loss.argmin(dim=0,keepdim=True)
-            r_list.append(torch.gather(grid_maps['roughness'].flatten(), 0, min_idx.flatten()).reshape(min_idx.shape))
-            m_list.append(torch.gather(grid_maps['metallic'].flatten(), 0, min_idx.flatten()).reshape(min_idx.shape))
-            rgb_list.append(torch.gather(_rgb, 0, min_idx.repeat(1,1,1,1,3)))
-        rgb = torch.cat(rgb_list).permute(0,1,4,2,3)
-        roughness = torch.cat(r_list).permute(0,1,4,2,3)
-        metallic = torch.cat(m_list).permute(0,1,4,2,3)
-        loss = (render[None] - rgb).abs().sum(2,keepdim=True)
-        roughness = torch.gather(roughness, 0, loss.argmin(dim=0,keepdim=True))[0]
-        metallic = torch.gather(metallic, 0, loss.argmin(dim=0,keepdim=True))[0]
-        torch.cuda.empty_cache()
+        if self.approxRM_search != "exhaustive":
+            terms = self.compute_render_terms(maps, cameras, pos, light)
+            roughness, metallic = self.search_rou_met(render, terms, r_samples.to(render), m_samples.to(render))
+        else:
+            grid_maps = {} # change map size into: gs, bs, h, w, c
+            grid_maps['basecolor'] = maps['basecolor'][None].permute(0,1,3,4,2)
+            grid_maps['normal'] = maps['normal'][None].permute(0,1,3,4,2)
+            r_values = r_samples[:,None].repeat(1,len(m_samples)).reshape(-1,1,1,1,1).to(maps['basecolor'])
+            m_values = m_samples[None].repeat(len(r_samples),1).reshape(-1,1,1,1,1).to(maps['basecolor'])
+            # split into chunks sized to the memory budget to avoid OOM
+            chunk_size = self.approxRM_chunk_size(bs, h, w, render.element_size())
+            target = render[None].permute(0,1,3,4,2)
+            # running argmin, ties keep the earliest candidate
+            best_loss = torch.full((bs, h, w, 1), float("inf"), device=render.device, dtype=render.dtype)
+            roughness = torch.zeros_like(best_loss)
+            metallic = torch.zeros_like(best_loss)
+            for _r, _m in zip(torch.split(r_values, chunk_size), torch.split(m_values, chunk_size)):
+                grid_maps['roughness'], grid_maps['metallic'] = _r, _m
+                _rgb = self.compute_render(grid_maps, cameras, pos, light)
+                loss, min_idx = (target - _rgb).abs().sum(-1,keepdim=True).min(dim=0)
+                del _rgb
+                better = loss < best_loss
+                best_loss = torch.where(better, loss, best_loss)
+                roughness = torch.where(better, _r.flatten()[min_idx].to(roughness), roughness)
+                metallic = torch.where(better, _m.flatten()[min_idx].to(metallic), metallic)
+            roughness, metallic = roughness.permute(0,3,1,2), metallic.permute(0,3,1,2)
+        if render.is_cuda:
+            torch.cuda.empty_cache()
         if seperate:
             return roughness, metallic
         else:
@@ -234,45 +328,194 @@ class Chord(Base):
 
         return rgb
     
-    def forward(self, maps:dict):
+    @torch.no_grad()
+    def compute_render_terms(self, maps, camera_position, pos, light):
+        '''
+            Per-pixel factors of compute_render that do not depend on roughness or metallic,
+            so candidate materials can be scored without re-rendering from scratch.
+            maps: bs, h, w, c
+        '''
+        def cos(x, y): 
+            return torch.clamp((x*y).sum(-1, keepdim=True), min=0, max=1)
+
+        albedo = srgb_to_rgb(maps['basecolor'].permute(0,2,3,1))
+        normal = maps['normal'].permute(0,2,3,1).clone()
+        normal[..., :2] = normal[..., [1,0]]
+        N = Fn.normalize((normal - 0.5) * 2.0, dim=-1, eps=1e-6)
+        V = Fn.normalize(camera_position - pos, dim=-1, eps=1e-6).to(self.device)
+        irradiance, L = light(pos)
+        irradiance, L = irradiance.to(self.device), L.to(self.device)
+        H = Fn.normalize(L+V, dim=-1, eps=1e-6)
+        return {
+            "albedo": albedo,
+            "NL": cos(N,L),
+            "NV": cos(N,V),
+            "NH": cos(N,H),
+            "HV5": torch.pow(1.0 - cos(H,V), 5.0),
+            "irradiance": irradiance * cos(N,L),
+            "spec_denom": 4.0 * cos(N,V) * cos(N,L) + 1e-3,
+        }
+
+    @torch.no_grad()
+    def search_rou_met(self, render, terms, r_samples, m_samples):
+        '''
+            Per-pixel (roughness, metallic) search over the same grid as the exhaustive
+            approxRM search, scored with precomputed render terms:
+            rgb = base[m] + D(r) * G(r) * spec[m], where base/spec depend only on metallic
+            and the roughness lobe D*G is a single channel.
+            "factorized" scores every grid candidate, "coarse_to_fine" scores every
+            approxRM_coarse_stride-th roughness, then refines each pixel around its best
+            coarse roughness at its best metallic.
+            render: bs, 3, h, w (linear)
+        '''
+        render = render.permute(0,2,3,1)
+        albedo = terms["albedo"]
+        base, spec = [], []
+        for m in m_samples:
+            F0 = torch.lerp(torch.full_like(albedo, 0.04), albedo, m)
+            F = F0 + (1.0 - F0) * terms["HV5"]
+            diffuse = (1 - F) * albedo / torch.pi * (1 - m)
+            base.append(diffuse * terms["irradiance"] + 0.3 * albedo)
+            spec.append(F * terms["irradiance"] / terms["spec_denom"])
+        base, spec = torch.stack(base), torch.stack(spec) # ms, bs, h, w, 3
+
+        def lobe(r):
+            return DistributionGGX(terms["NH"], r) * GeometrySchlickGGX(terms["NL"], r) * GeometrySchlickGGX(terms["NV"], r)
+
+        # running argmin, ties keep the earliest candidate like the exhaustive search
+        best_loss = torch.full_like(terms["NL"], float("inf"))
+        best_r = torch.zeros_like(best_loss, dtype=torch.long)
+        best_m = torch.zeros_like(best_loss, dtype=torch.long)
+        def update(loss, r_idx, m_idx):
+            better = loss < best_loss
+            best_loss.copy_(torch.where(better, loss, best_loss))
+            best_r.copy_(torch.where(better, r_idx, best_r))
+            best_m.copy_(torch.where(better, m_idx, best_m))
+
+        stride = 1 if self.approxRM_search == "factorized" else max(1, int(self.approxRM_coarse_stride))
+        coarse = list(range(0, len(r_samples), stride))
+        if coarse[-1] != len(r_samples) - 1:
+            coarse.append(len(r_samples) - 1)
+        # best coarse roughness of every metallic candidate, refined below
+        coarse_loss = torch.full((len(m_samples), *best_loss.shape), float("inf"), device=best_loss.device)
+        coarse_r = torch.zeros_like(coarse_loss, dtype=torch.long)
+        for i in coarse:
+            D_G = lobe(r_samples[i])
+            for j in range(len(m_samples)):
+                loss = (render - (base[j] + D_G * spec[j])).abs().sum(-1, keepdim=True)
+                update(loss, torch.full_like(best_r, i), torch.full_like(best_m, j))
+                better = loss < coarse_loss[j]
+                coarse_loss[j] = torch.where(better, loss, coarse_loss[j])
+                coarse_r[j] = torch.where(better, i, coarse_r[j])
+        if stride > 1:
+            for offset in range(-(stride - 1), stride):
+                if offset == 0: continue
+                for j in range(len(m_samples)):
+                    r_idx = torch.clamp(coarse_r[j] + offset, 0, len(r_samples) - 1)
+                    loss = (render - (base[j] + lobe(r_samples[r_idx]) * spec[j])).abs().sum(-1, keepdim=True)
+                    update(loss, r_idx, torch.full_like(best_m, j))
+        roughness = r_samples[best_r].permute(0,3,1,2)
+        metallic = m_samples[best_m].permute(0,3,1,2)
+        return roughness, metallic
+
+    # chain step whose prediction each intermediate representation is computed from, see forward
+    intermediate_sources = {"approxIrr": "basecolor", "approxRM": "normal"}
+
+    def chain_inputs(self, kout):
+        info = self.chain[kout].split("_")
+        return list(zip(info[:-1], info[-1]))
+
+    def required_steps(self, outputs=None):
+        '''
+            Chain steps the requested outputs depend on, in chain order. outputs are
+            chain keys or post_decoder names ("roughness"/"metalness" come from rou_met),
+            None runs the whole chain.
+        '''
+        if outputs is None:
+            return list(self.chain.keys())
+        pending = ["rou_met" if k in ("roughness", "metalness") else k for k in outputs]
+        needed = set()
+        while pending:
+            kout = pending.pop()
+            if kout in needed or kout not in self.chain: continue
+            needed.add(kout)
+            pending += [self.intermediate_sources.get(k, k) for k, i in self.chain_inputs(kout) if i == "1"]
+        return [kout for kout in self.chain if kout in needed]
+
+    def decoded_mid_chain(self, steps):
+        # predictions an intermediate representation is computed from are always decoded
+        consumed = {k for kout in steps for k, i in self.chain_inputs(kout) if i == "1"}
+        return {self.intermediate_sources[k] for k in consumed if k in self.intermediate_sources}
+
+    def forward(self, maps:dict, outputs=None, decode="per_step", return_latents=False):
+        '''
+            decode: "per_step" decodes every prediction right after its UNet pass, "none"
+            only decodes the predictions an intermediate representation is computed from
+            and leaves the rest in latent space. With return_latents the predicted latents
+            of every step are returned under "latents".
+        '''
         # prepare
         bs = maps['render'].shape[0]
         self.sd.scheduler.set_timesteps(1)
         t = self.sd.scheduler.timesteps[0]
+        # only run the chain prefix the requested outputs depend on
+        steps = self.required_steps(outputs)
+        consumed = {k for kout in steps for k, i in self.chain_inputs(kout) if i == "1"}
+        decode_now = self.decoded_mid_chain(steps)
         # chain processing
         pred, pred_latent, arxiv_latent = {}, {}, {}
-        for kout, info in self.chain.items():
-            info = info.split("_")
-            keys, ids = info[:-1], info[-1]
+        for kout in steps:
+            inputs = self.chain_inputs(kout)
             # Swap active LEGO blocks
             self.sd.unet.down_blocks[0] = self.sd.unet.FirstDownBlocks[kout]
             self.sd.unet.up_blocks[-1] = self.sd.unet.LastUpBlocks[kout]
             # Eq.2, summing input latents
             in_latent = 0
-            for k, i in zip(keys, ids):
+            for k, i in inputs:
                 if i=="0":
                     if not k in arxiv_latent.keys(): arxiv_latent[k] = self.sd.encode_imgs_deterministic(maps[k])
                     zx = arxiv_latent[k]
                 else:
                     zx = pred_latent[k]
                 in_latent += self.sd.unet.ConvIns[k](zx)
-            in_latent = in_latent / len(keys)
+            in_latent = in_latent / len(inputs)
             # single-step denoising
             embs = self.produce_embeddings(kout, bs)
             out_latent = self.sd.unet(in_latent, t, **embs)[0]
             out_latent = self.sd.unet.ConvOuts[kout](out_latent)            
             pred_latent[kout] = self.sd.scheduler.step(out_latent, t, torch.zeros_like(zx)).pred_original_sample
-            pred[kout] = self.sd.decode_latents(pred_latent[kout]).float()
+            if decode == "per_step" or kout in decode_now:
+                pred[kout] = self.sd.decode_latents(pred_latent[kout]).float()
             # compute intermediate representations
-            if self.chain_type in ["chord"] and kout == "basecolor":
+            if self.chain_type in ["chord"] and kout == "basecolor" and "approxIrr" in consumed:
                 pred['approxIrr'] = self.compute_approxIrr(maps['render'], pred['basecolor'])
                 pred_latent['approxIrr'] = self.sd.encode_imgs_deterministic(pred['approxIrr'])
-            if self.chain_type in ["chord"] and kout == "normal":
+            if self.chain_type in ["chord"] and kout == "normal" and "approxRM" in consumed:
                 pred['approxRM'] = self.compute_approxRouMet(maps['render'], pred, seperate=False)
                 pred_latent['approxRM'] = self.sd.encode_imgs_deterministic(pred['approxRM'])
 
+        if return_latents:
+            pred["latents"] = {kout: pred_latent[kout] for kout in steps}
         return pred     
     
+    def prompt_hash(self, key, padding_mode="max_length"):
+        # embeddings depend on the prompt text, the tokenizer and the padding
+        return hashlib.sha1(f"{self.sd.tokenizer_id}|{padding_mode}|{self.prompts[key]}".encode()).hexdigest()
+
+    @torch.no_grad()
+    def text_embedding_state(self):
+        '''
+            Embeddings of every prompt the chain uses, keyed by prompt_hash,
+            encoding any that are not cached yet.
+        '''
+        return {self.prompt_hash(key): self.produce_embeddings(key, 1)["encoder_hidden_states"].contiguous() for key in self.chain}
+
+    def load_text_embeddings(self, embeddings):
+        for key in self.chain:
+            h = self.prompt_hash(key)
+            if h in embeddings:
+                self.text_emb[key] = embeddings[h].to(self.device, self.dtype)
+
     @torch.no_grad()
     def produce_embeddings(self, key, batch_size):
         if key not in self.text_emb.keys():
@@ -1,5 +1,6 @@
 import torch 
 from typing import Optional
+import torch.nn as nn
 import torch.nn.functional as Fn
 import math
 import copy
@@ -27,6 +28,18 @@ class BaseLight(Base):
         d: directions of shape (..., 3).
         """
         raise NotImplementedError
+
+    def with_direction(self, direction: torch.Tensor):
+        """Copy of this light with a new direction attribute.
+
+        Lights without a direction (e.g. point lights) keep shading as before.
+
+        Args:
+            direction: Light vector of shape [3], or [B, 3] for one direction per sample.
+        """
+        light = copy.deepcopy(self)
+        light.direction = direction
+        return light
     
 
 @register("point-light")
@@ -82,15 +95,31 @@ class DistantLight(BaseLight):
         self.register_buffer("color", torch.tensor(color) * power)
         self.register_buffer("direction", Fn.normalize(torch.tensor(direction), dim=0))
 
+    def with_direction(self, direction: torch.Tensor):
+        """Copy of this light sharing its color buffer, with a new direction.
+
+        Args:
+            direction: Light vector of shape [3], or [B, 3] for one direction per sample.
+        """
+        light = DistantLight.__new__(DistantLight)
+        nn.Module.__init__(light)
+        light.config, light.device = self.config, self.device
+        light.register_buffer("color", self.color)
+        light.register_buffer("direction", direction)
+        return light
+
     def forward(self, x: Optional[torch.Tensor] = None):
         """Compute light radiance and direction.
 
         Args:
-            x : World coordinate of the interacting surface. [B, H, W, 3]
+            x : World coordinate of the interacting surface. [H, W, 3]
         Returns:
-            color: radiance intensity of shape [B, H, W, 3]
-            d: directions of shape [B, H, W, 3]
+            color: radiance intensity of shape [H, W, 3]
+            d: directions of shape [H, W, 3], or [B, H, W, 3] for a per-sample direction
         """
         radiance = self.color.repeat(*x.shape[:-1], 1)
-        direction = self.direction.repeat(*x.shape[:-1], 1)
+        if self.direction.dim() == 2:
+            direction = self.direction[:, None, None, :].expand(-1, *x.shape[:-1], -1)
+        else:
+            direction = self.direction.repeat(*x.shape[:-1], 1)
         return radiance, direction
\ No newline at end of file
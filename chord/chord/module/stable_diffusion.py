@@ -6,6 +6,9 @@ from transformers import CLIPTextModel, CLIPTextConfig, CLIPTokenizer
 
 from . import register
 from .base import Base
+from ..runtime import cpu_dtype
+from ..quantize import quantize_int8
+from ..tiling import run_tiled
 
 
 def apply_padding(model, mode):
@@ -26,10 +29,26 @@ def freeze(model):
 class StableDiffusion(Base):
     def setup(self):
         hf_key = self.config.get("hf_key", None)
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = torch.device(self.config.get("device", None) or ("cuda" if torch.cuda.is_available() else "cpu"))
         fp16 = self.config.get("fp16", True)
         self.dtype = torch.bfloat16 if fp16 else torch.float32
+        self.channels_last = False
+        if self.device.type == "cpu":
+            # CPU profile: bf16 only where the CPU runs it natively, NHWC convolutions for oneDNN
+            self.dtype = cpu_dtype(self.config.get("cpu_dtype", "auto")) if fp16 else torch.float32
+            self.channels_last = self.config.get("cpu_channels_last", True)
         vae_padding = self.config.get("vae_padding", "zeros")
+        self.vae_padding = vae_padding
+        # padding of every UNet and VAE convolution once set_padding ran, None while they differ
+        self.padding_mode = None
+        # tiled VAE encode/decode in pixels, 0 disables tiling
+        self.vae_tile_size = self.config.get("vae_tile_size", 0)
+        self.vae_tile_overlap = self.config.get("vae_tile_overlap", 128)
+        # False when prompt embeddings are provided from a cache, see Chord.load_text_embeddings
+        use_text_encoder = self.config.get("text_encoder", True)
+        # parameters live on the meta device until ChordModel.assign_checkpoint assigns them
+        self.empty_weights = self.config.get("empty_weights", False)
+        self.init_device = None if self.empty_weights else self.device
 
         self.sd_version = self.config.get("version", 2.1)
         # Force local files only for ComfyUI Desktop compatibility
@@ -101,7 +120,7 @@ class StableDiffusion(Base):
                 # load_config doesn't support local_files_only, but will use cache if available
                 unet_config = UNet2DConditionModel.load_config(model_key, subfolder="unet")
             self.unet = UNet2DConditionModel.from_config(unet_config, local_files_only=local_files_only)
-            self.unet.to(self.device, dtype=self.dtype).eval()
+            self.unet.to(self.init_device, dtype=self.dtype).eval()
             print(f"[ComfyUI-Chord] UNet loaded successfully")
             
             # 2. VAE (image autoencoder)
@@ -111,21 +130,27 @@ class StableDiffusion(Base):
             except TypeError:
                 vae_config = AutoencoderKL.load_config(model_key, subfolder="vae")
             self.vae = AutoencoderKL.from_config(vae_config, local_files_only=local_files_only)
-            self.vae.to(self.device, dtype=self.dtype).eval()
+            self.vae.to(self.init_device, dtype=self.dtype).eval()
             self.vae = apply_padding(freeze(self.vae), vae_padding)
             print(f"[ComfyUI-Chord] VAE loaded successfully")
             
             # 3. Text encoder (CLIP)
-            print(f"[ComfyUI-Chord] Loading CLIP text encoder config...")
-            text_encoder_config = CLIPTextConfig.from_pretrained(model_key, subfolder="text_encoder", local_files_only=local_files_only)
-            self.text_encoder = CLIPTextModel(text_encoder_config)
-            self.text_encoder.to(self.device, dtype=self.dtype).eval()
-            print(f"[ComfyUI-Chord] CLIP text encoder loaded successfully")
-            
             # 4. Tokenizer (CLIP tokenizer, this one has vocab so from_pretrained is needed)
-            print(f"[ComfyUI-Chord] Loading CLIP tokenizer...")
-            self.tokenizer = CLIPTokenizer.from_pretrained(model_key, subfolder="tokenizer", local_files_only=local_files_only)
-            print(f"[ComfyUI-Chord] CLIP tokenizer loaded successfully")
+            self.tokenizer_id = f"{model_key}/tokenizer"
+            if use_text_encoder:
+                print(f"[ComfyUI-Chord] Loading CLIP text encoder config...")
+                text_encoder_config = CLIPTextConfig.from_pretrained(model_key, subfolder="text_encoder", local_files_only=local_files_only)
+                self.text_encoder = CLIPTextModel(text_encoder_config)
+                self.text_encoder.to(self.init_device, dtype=self.dtype).eval()
+                print(f"[ComfyUI-Chord] CLIP text encoder loaded successfully")
+
+                print(f"[ComfyUI-Chord] Loading CLIP tokenizer...")
+                self.tokenizer = CLIPTokenizer.from_pretrained(model_key, subfolder="tokenizer", local_files_only=local_files_only)
+                print(f"[ComfyUI-Chord] CLIP tokenizer loaded successfully")
+            else:
+                print(f"[ComfyUI-Chord] Skipping CLIP text encoder and tokenizer, using cached prompt embeddings")
+                self.text_encoder = None
+                self.tokenizer = None
             
             # 5. Scheduler
             print(f"[ComfyUI-Chord] Loading scheduler config...")
@@ -158,8 +183,38 @@ class StableDiffusion(Base):
             print(error_msg)
             raise RuntimeError(error_msg) from e
 
+    def set_padding(self, mode):
+        '''
+        Switch every UNet and VAE convolution to 'circular' (tileable) or 'zeros' padding.
+        The module walk only happens when the requested mode differs from the current one.
+        '''
+        if mode == self.padding_mode:
+            return
+        apply_padding(self.unet, mode)
+        apply_padding(self.vae, mode)
+        self.padding_mode = mode
+        self.vae_padding = mode
+
+    def to_channels_last(self):
+        self.unet.to(memory_format=torch.channels_last)
+        self.vae.to(memory_format=torch.channels_last)
+
+    def quantize(self, vae_decoder=False):
+        # weight-only int8 for the UNet (LEGO copies included) and optionally the VAE decoder
+        count = quantize_int8(self.unet)
+        if vae_decoder:
+            count += quantize_int8(self.vae.decoder)
+        return count
+
+    def drop_text_encoder(self):
+        # free the CLIP text encoder once every prompt embedding is cached
+        self.text_encoder = None
+        self.tokenizer = None
+
     def encode_text(self, prompt, padding_mode="do_not_pad"):
         # prompt: [str]
+        if self.text_encoder is None:
+            raise RuntimeError(f"[ComfyUI-Chord] No text encoder loaded to encode prompt {prompt!r}, and no cached embedding for it.")
         inputs = self.tokenizer(
             prompt,
             padding=padding_mode,
@@ -169,9 +224,20 @@ class StableDiffusion(Base):
         embeddings = self.text_encoder(inputs.input_ids.to(self.device))[0]
         return embeddings    
 
+    def use_vae_tiling(self, h, w):
+        return bool(self.vae_tile_size) and max(h, w) > self.vae_tile_size
+
+    def unscale_latents(self, latents):
+        # the UNet works on latents scaled by the VAE's scaling factor, the VAE itself on unscaled ones
+        return 1 / self.vae.config.scaling_factor * latents
+
     def decode_latents(self, latents):
-        latents = 1 / self.vae.config.scaling_factor * latents
-        imgs = self.vae.decode(latents).sample
+        latents = self.unscale_latents(latents)
+        if self.use_vae_tiling(latents.shape[-2] * 8, latents.shape[-1] * 8):
+            imgs = run_tiled(lambda z: self.vae.decode(z).sample, latents,
+                             self.vae_tile_size // 8, self.vae_tile_overlap // 8, 8, self.vae_padding == 'circular')
+        else:
+            imgs = self.vae.decode(latents).sample
         imgs = (imgs / 2 + 0.5).clamp(0, 1)
         return imgs
 
@@ -187,8 +253,16 @@ class StableDiffusion(Base):
         if imgs.shape[1] == 1: # for grayscale maps
             imgs = v2.functional.grayscale_to_rgb(imgs)
         imgs = 2 * imgs - 1
+        if self.use_vae_tiling(*imgs.shape[-2:]):
+            mean = run_tiled(self.encode_mean, imgs,
+                             self.vae_tile_size, self.vae_tile_overlap, 1 / 8, self.vae_padding == 'circular')
+        else:
+            mean = self.encode_mean(imgs)
+        latents = mean * self.vae.config.scaling_factor
+        return latents
+
+    def encode_mean(self, imgs):
         h = self.vae.encoder(imgs)
         moments = self.vae.quant_conv(h)
         mean, logvar = torch.chunk(moments, 2, dim=1)
-        latents = mean * self.vae.config.scaling_factor
-        return latents
\ No newline at end of file
+        return mean
\ No newline at end of file
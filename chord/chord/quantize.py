@@ -0,0 +1,44 @@
+import torch
+import torch.nn as nn
+
+class Int8WeightOnly(nn.Module):
+    '''
+    Linear or Conv2d whose weight is stored as int8 with one absmax scale per output
+    channel. The weight is dequantised to the model dtype on every call, so weight
+    memory halves against bf16 while activations keep their precision. The wrapped
+    layer is kept (without its weight) so padding and memory format still apply to it.
+    '''
+    def __init__(self, module):
+        super().__init__()
+        weight = module.weight.detach()
+        scale = weight.float().abs().amax(dim=tuple(range(1, weight.dim())), keepdim=True).clamp_min(1e-12) / 127
+        self.register_buffer("weight_int8", torch.round(weight.float() / scale).to(torch.int8))
+        self.register_buffer("weight_scale", scale.to(weight.dtype))
+        del module.weight
+        self.module = module
+
+    def forward(self, x):
+        self.module.weight = self.weight_int8.to(self.weight_scale.dtype) * self.weight_scale
+        try:
+            return self.module(x)
+        finally:
+            self.module.weight = None
+
+def quantize_int8(module, min_elements=2**14, _memo=None):
+    '''
+    Replace every Linear and Conv2d of module with at least min_elements weights by
+    Int8WeightOnly, in place. Layers shared between parents (e.g. the active LEGO
+    blocks) are quantised once. Returns the number of quantised layers.
+    '''
+    memo = {} if _memo is None else _memo
+    count = 0
+    for name, child in list(module.named_children()):
+        if id(child) in memo:
+            setattr(module, name, memo[id(child)])
+        elif isinstance(child, (nn.Linear, nn.Conv2d)) and child.weight.numel() >= min_elements:
+            memo[id(child)] = Int8WeightOnly(child)
+            setattr(module, name, memo[id(child)])
+            count += 1
+        elif not isinstance(child, Int8WeightOnly):
+            count += quantize_int8(child, min_elements, memo)
+    return count
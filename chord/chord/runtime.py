@@ -0,0 +1,49 @@
+import contextlib
+import torch
+
+def cpu_supports_bf16():
+    '''
+    True when the CPU has native bf16 instructions (AVX512-BF16 or AMX on x86, BF16 on
+    arm64), as reported by torch on every platform. Elsewhere bf16 is emulated and
+    runs slower than fp32.
+    '''
+    try:
+        if torch.backends.cpu.get_cpu_capability().startswith("AVX"):
+            # oneDNN accepts bf16 on any AVX512 CPU, only these run it natively
+            return torch.cpu._is_avx512_bf16_supported() or torch.cpu._is_amx_tile_supported()
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+def cpu_dtype(mode="auto"):
+    # "auto" picks bf16 only where the CPU runs it natively
+    if mode == "auto":
+        return torch.bfloat16 if cpu_supports_bf16() else torch.float32
+    return torch.bfloat16 if mode == "bf16" else torch.float32
+
+def configure_cpu_threads(threads=0, interop_threads=0):
+    '''
+    Intra-op and inter-op thread counts of the process, 0 keeps the current count.
+    The inter-op pool can only be sized before it first runs work.
+    '''
+    if threads > 0 and threads != torch.get_num_threads():
+        print(f"[ComfyUI-Chord] Setting CPU threads from {torch.get_num_threads()} to {threads}")
+        torch.set_num_threads(threads)
+    if interop_threads > 0 and interop_threads != torch.get_num_interop_threads():
+        print(f"[ComfyUI-Chord] Setting CPU inter-op threads from {torch.get_num_interop_threads()} to {interop_threads}")
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            print(f"[ComfyUI-Chord] Could not set inter-op threads to {interop_threads}: {e}")
+
+def inference_autocast(device, dtype=None):
+    '''
+    Autocast context for the device: fp16 on CUDA as before, the given dtype on CPU,
+    and no autocast at all when the CPU runs in fp32.
+    '''
+    device = torch.device(device)
+    if device.type == "cpu":
+        if dtype is None or dtype == torch.float32:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type="cpu", dtype=dtype)
+    return torch.autocast(device_type=device.type)
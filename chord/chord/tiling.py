@@ -0,0 +1,117 @@
+import math
+import torch
+
+def define_tiles(h: int, w: int, tile_size: int = 1024, overlap: int = 256, periodic: bool = True) -> list:
+    '''
+    Top-left corners of overlapping tiles covering an h x w image.
+    With periodic=True tiles past the right/bottom border wrap around, so the last
+    tiles overlap the first ones and the blended result stays tileable. Otherwise
+    the last row/column of tiles is clamped inside the image.
+    '''
+    stride = max(1, tile_size - overlap)
+    def starts(size):
+        if periodic:
+            return [i * stride for i in range(max(1, math.ceil(size / stride)))]
+        if size <= tile_size:
+            return [0]
+        return list(range(0, size - tile_size, stride)) + [size - tile_size]
+    return [(y, x) for y in starts(h) for x in starts(w)]
+
+def as_shape(tile_size) -> tuple:
+    # tile sizes are either one int for square tiles or a (th, tw) pair
+    return (tile_size, tile_size) if isinstance(tile_size, int) else tuple(tile_size)
+
+def tile_shape(h: int, w: int, tile_size: int, periodic: bool = True) -> tuple:
+    '''
+    (th, tw) of the tiles define_tiles places on an h x w image. Periodic tiles are
+    always tile_size square and wrap around a shorter side; the others are clipped
+    to the image so that they never hold wrapped-around content.
+    '''
+    if periodic:
+        return (tile_size, tile_size)
+    return (min(tile_size, h), min(tile_size, w))
+
+def feather_weight(tile_size, overlap: int, device=None) -> torch.tensor:
+    '''
+    Separable cosine feathering of a tile_size or (th, tw) tile, strictly positive
+    so that every pixel keeps a non-zero normalising weight.
+    '''
+    def feather(size):
+        weight = torch.ones(size, device=device)
+        ramp_size = min(overlap, size)
+        if ramp_size > 0:
+            ramp = 0.5 * (1 - torch.cos(torch.pi * torch.linspace(0, 1, ramp_size + 2, device=device)[1:-1]))
+            weight[:ramp_size] = ramp
+            weight[-ramp_size:] = torch.minimum(weight[-ramp_size:], ramp.flip(0))
+        return weight
+    th, tw = as_shape(tile_size)
+    return feather(th)[:, None] * feather(tw)[None, :]
+
+def extract_tiles(image: torch.tensor, tiles: list, tile_size) -> torch.tensor:
+    '''
+    Args:
+        image: torch.tensor(B, C, H, W)
+        tile_size: int or (th, tw)
+    Returns:
+        torch.tensor(B * N, C, th, tw), tiles of each image in order
+    '''
+    h, w = image.shape[-2:]
+    th, tw = as_shape(tile_size)
+    device = image.device
+    out = []
+    for y, x in tiles:
+        rows = torch.arange(y, y + th, device=device) % h
+        cols = torch.arange(x, x + tw, device=device) % w
+        out.append(image.index_select(-2, rows).index_select(-1, cols))
+    return torch.stack(out, dim=1).flatten(0, 1)
+
+def add_tile(out: torch.tensor, tile_map: torch.tensor, y: int, x: int, weight: torch.tensor) -> None:
+    '''
+    Feathered add of one (..., C, th, tw) tile with top-left corner (y, x) into
+    out (..., C, H, W) in place, wrapping around the borders.
+    '''
+    h, w = out.shape[-2:]
+    th, tw = tile_map.shape[-2:]
+    device = out.device
+    rows = torch.arange(y, y + th, device=device) % h
+    cols = torch.arange(x, x + tw, device=device) % w
+    index = (rows[:, None] * w + cols[None, :]).flatten()
+    out.view(*out.shape[:-2], h * w).index_add_(-1, index, (tile_map * weight).flatten(-2).to(out.dtype))
+
+def tile_norm(
+    tiles: list,
+    tile_size,
+    h: int,
+    w: int,
+    weight: torch.tensor,
+    epsilon: float = 1e-8,
+) -> torch.tensor:
+    '''
+    Summed feather weights of a tiling, the (H, W) normaliser of add_tile.
+    '''
+    norm = torch.zeros((h, w), device=weight.device, dtype=weight.dtype)
+    for y, x in tiles:
+        add_tile(norm, torch.ones(as_shape(tile_size), device=weight.device, dtype=weight.dtype), y, x, weight)
+    return norm.clamp_min(epsilon)
+
+def run_tiled(fn, x: torch.tensor, tile_size: int, overlap: int, scale: float = 1, periodic: bool = True) -> torch.tensor:
+    '''
+    Apply fn to overlapping tile_size windows of x (B, C, H, W) one at a time and
+    blend the outputs, which are scale times the input size, with a cosine feather.
+    With periodic=True windows wrap around the borders to match circular padding,
+    otherwise they are clipped to a side shorter than tile_size.
+    '''
+    bs, _, h, w = x.shape
+    th, tw = tile_shape(h, w, tile_size, periodic)
+    out_tile, out_overlap = (int(th * scale), int(tw * scale)), int(overlap * scale)
+    oh, ow = int(h * scale), int(w * scale)
+    tiles = define_tiles(h, w, tile_size, overlap, periodic)
+    out_tiles = [(int(y * scale), int(x0 * scale)) for y, x0 in tiles]
+    weight = feather_weight(out_tile, out_overlap, x.device)
+    out = None
+    for (y, x0), (out_y, out_x) in zip(tiles, out_tiles):
+        y_tile = fn(extract_tiles(x, [(y, x0)], (th, tw)))
+        if out is None:
+            out = torch.zeros((bs, y_tile.shape[1], oh, ow), device=x.device, dtype=torch.float32)
+        add_tile(out, y_tile.float(), out_y, out_x, weight)
+    return (out / tile_norm(out_tiles, out_tile, oh, ow, weight)).to(y_tile.dtype)
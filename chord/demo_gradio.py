@@ -43,7 +43,7 @@ def run_model(model, img: Image.Image):
     to_tensor = v2.Compose([v2.ToImage(), v2.ToDtype(torch.float32, scale=True)])
     image = to_tensor(img).to(next(model.parameters()).device)
     x = v2.Resize(size=(1024, 1024), antialias=True)(image).unsqueeze(0)
-    with torch.no_grad() as no_grad, torch.autocast(device_type="cuda") as amp:
+    with torch.no_grad() as no_grad, model.autocast() as amp:
         output = model(x)
     output.update({"input": image}) 
     return output
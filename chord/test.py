@@ -52,7 +52,7 @@ def inference(
         ori_h, ori_w = image.shape[-2:]
         x = v2.Resize(size=(1024, 1024), antialias=True)(image).unsqueeze(0)
         image_name = Path(image_file).stem
-        with torch.no_grad() as no_grad, torch.autocast(device_type="cuda") as amp:
+        with torch.no_grad() as no_grad, model.autocast() as amp:
             output = model(x)
         for key in output.keys():
             output[key] = v2.Resize(size=(ori_h, ori_w), antialias=True)(output[key])
@@ -0,0 +1,127 @@
+import os
+import shutil
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+DEFAULT_CACHE_DIR = os.path.expanduser("~/.cache/comfyui-chord/materials")
+
+def file_identity(path: str) -> str:
+    '''
+    Cheap identity of a checkpoint file: its path, size and modification time.
+    '''
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+class MaterialCache:
+    """
+    Content-addressed cache of material estimation results.
+
+    Entries are keyed by a hash of the input pixels, the checkpoint identity and
+    the inference settings. Each entry is a directory of fp16 .npy files (one per
+    output map) that are memory-mapped on read. A small in-memory LRU sits in
+    front of the disk store; both levels evict least recently used entries once
+    their size budget is exceeded.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_disk_bytes: int = 4 * 1024 ** 3,
+        max_memory_bytes: int = 512 * 1024 ** 2,
+    ):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image: torch.Tensor, ckpt_identity: str, settings: dict) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr((tuple(image.shape), str(image.dtype), ckpt_identity, sorted(settings.items()))).encode())
+        digest.update(image.detach().cpu().contiguous().numpy().tobytes())
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        '''
+        Returns a dict of float32 CPU tensors, or None on a miss.
+        '''
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return {name: value.float() for name, value in self.memory[key].items()}
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(entry_dir):
+            self.misses += 1
+            return None
+        try:
+            maps = {
+                os.path.splitext(name)[0]: torch.from_numpy(np.load(os.path.join(entry_dir, name), mmap_mode="r").astype(np.float32))
+                for name in os.listdir(entry_dir) if name.endswith(".npy")
+            }
+        except (OSError, ValueError):
+            # partially written or corrupted entry
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            self.misses += 1
+            return None
+        os.utime(entry_dir) # mtime doubles as the LRU clock of the disk store
+        self._remember(key, {name: value.half() for name, value in maps.items()})
+        self.hits += 1
+        return maps
+
+    def put(self, key: str, maps: dict) -> None:
+        maps = {name: value.detach().cpu().half() for name, value in maps.items()}
+        self._remember(key, maps)
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = f"{entry_dir}.tmp{os.getpid()}"
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            for name, value in maps.items():
+                np.save(os.path.join(tmp_dir, name + ".npy"), value.numpy())
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+            self._evict_disk()
+        except OSError as e:
+            # a full or read-only disk only costs the disk copy, the entry stays in memory
+            print(f"[ComfyUI-Chord] Could not write material cache entry to {self.cache_dir}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _remember(self, key: str, maps: dict) -> None:
+        size = sum(value.numel() * value.element_size() for value in maps.values())
+        if size > self.max_memory_bytes:
+            return
+        if key in self.memory:
+            self.memory_bytes -= sum(v.numel() * v.element_size() for v in self.memory.pop(key).values())
+        self.memory[key] = maps
+        self.memory_bytes += size
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= sum(v.numel() * v.element_size() for v in evicted.values())
+
+    def _evict_disk(self) -> None:
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, key)
+            if not os.path.isdir(entry_dir) or ".tmp" in key:
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+            entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_bytes,
+        }
@@ -0,0 +1,64 @@
+import json
+import hashlib
+from collections import OrderedDict
+
+class ModelCache:
+    """
+    Process-wide cache of loaded Chord models.
+
+    Entries are keyed by the checkpoint identity (path, size and mtime), a hash of
+    the model config and the load options, so every workflow asking for the same
+    model gets the same instance back. Once more than max_models are cached the
+    least recently used one is evicted and handed to on_evict, which lets the caller
+    unload it from the device before the last reference is dropped.
+    """
+
+    def __init__(self, max_models: int = 2, on_evict=None):
+        self.max_models = max_models
+        self.on_evict = on_evict
+        self.models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = {}
+
+    @staticmethod
+    def make_key(ckpt_identity: str, config: dict, **options) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(json.dumps([ckpt_identity, config, options], sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        if key not in self.models:
+            self.misses += 1
+            return None
+        self.models.move_to_end(key)
+        self.hits += 1
+        return self.models[key]
+
+    def put(self, key: str, model, load_seconds: float) -> None:
+        self.models[key] = model
+        self.models.move_to_end(key)
+        self.load_seconds[key] = load_seconds
+        while len(self.models) > self.max_models:
+            evicted_key, evicted = self.models.popitem(last=False)
+            self.load_seconds.pop(evicted_key, None)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def clear(self) -> None:
+        while self.models:
+            _, evicted = self.models.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+        self.load_seconds.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "models": len(self.models),
+            "load_seconds": dict(self.load_seconds),
+        }
@@ -1,8 +1,8 @@
 import os
 import sys
+import json
+import time
 import torch
-from omegaconf import OmegaConf
-from torchvision.transforms import v2
 
 # Add the current directory and chord subdirectory to path for imports
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -12,36 +12,84 @@ if current_dir not in sys.path:
 if chord_dir not in sys.path:
     sys.path.insert(0, chord_dir)
 
-from normal_to_height import normal_to_height
+from normal_to_height import normal_to_height, predict_skip_normalize, POISSON_SOLVERS, HEIGHT_MODES
+from material_cache import MaterialCache, file_identity
+from model_cache import ModelCache
 
 # Modules from ComfyUI
 import folder_paths
 import comfy.model_management
 from comfy.utils import load_torch_file
 from comfy.model_patcher import ModelPatcher
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
 
-# Modules from ComfyUI-Chord
-from chord import ChordModel
+# The Chord model stack (chord, diffusers, transformers, omegaconf) is imported on the
+# first ChordLoadModel run so that registering the nodes at startup stays cheap
 
-def apply_padding(model, mode):
-    for layer in [layer for _, layer in model.named_modules() if isinstance(layer, torch.nn.Conv2d)]:
-        layer.padding_mode = mode
+def resize(x, size):
+    # antialiased bilinear resize of (..., H, W), matches torchvision's v2.Resize on tensors
+    h, w = x.shape[-2:]
+    out = torch.nn.functional.interpolate(x.reshape(-1, 1, h, w), size=size, mode="bilinear", antialias=True)
+    return out.reshape(*x.shape[:-2], *size)
 
-def apply_circular_padding(model):
-    if hasattr(model, 'sd'):
-        apply_padding(model.sd.vae, 'circular')
-        apply_padding(model.sd.unet, 'circular')
-    else:
-        apply_padding(model, 'circular')
+def text_embeddings_path(ckpt_path):
+    return os.path.splitext(ckpt_path)[0] + ".text_emb.safetensors"
+
+def text_embeddings_identity(ckpt_identity, config):
+    from omegaconf import OmegaConf
+    # the cached embeddings are stale once the checkpoint, the prompts or the SD tokenizer change
+    sd_config = config.model.stable_diffusion
+    prompts = json.dumps(OmegaConf.to_container(config.model.rgbx_prompts), sort_keys=True)
+    return f"{ckpt_identity}|{prompts}|{sd_config.get('hf_key', None)}|{sd_config.get('version', 2.1)}"
+
+def read_text_embeddings(ckpt_path, identity):
+    """Cached prompt embeddings stored next to the checkpoint, or None if absent or stale."""
+    path = text_embeddings_path(ckpt_path)
+    if not os.path.exists(path):
+        return None
+    with safe_open(path, framework="pt") as f:
+        if (f.metadata() or {}).get("identity") != identity:
+            return None
+    return load_file(path)
+
+def write_text_embeddings(ckpt_path, identity, embeddings):
+    path = text_embeddings_path(ckpt_path)
+    try:
+        save_file({k: v.cpu() for k, v in embeddings.items()}, path, metadata={"identity": identity})
+        print(f"[ComfyUI-Chord] Saved prompt embeddings to {path}")
+    except OSError as e:
+        print(f"[ComfyUI-Chord] Could not save prompt embeddings next to the checkpoint: {e}")
+
+def log_model_cache_stats(stats):
+    print(f"[ComfyUI-Chord] Model cache: {stats['models']} loaded, {stats['hits']} hits, "
+          f"{stats['misses']} misses, {stats['evictions']} evictions")
+
+def release_model_patcher(model_patcher):
+    # unload an evicted model from the device so comfy does not keep it resident
+    loaded_models = comfy.model_management.current_loaded_models
+    for i in reversed(range(len(loaded_models))):
+        if loaded_models[i].model is model_patcher:
+            loaded_models.pop(i).model_unload()
 
 class ChordLoadModel:
     """Node to load Chord Model"""
 
+    # shared by every node instance so workflows reuse loaded models
+    model_cache = None
+
     @classmethod
     def INPUT_TYPES(cls):
         return {
             "required": {
                 "ckpt_name": (folder_paths.get_filename_list("checkpoints"), ),
+            },
+            "optional": {
+                # "cached_embeddings" precomputes the prompt embeddings once, stores them next
+                # to the checkpoint and never builds the CLIP text encoder afterwards
+                "text_encoder": (["load", "cached_embeddings"], {"default": "load"}),
+                # weight-only int8 roughly halves the weights of the quantised parts
+                "quantize": (["none", "int8_unet", "int8_unet_vae"], {"default": "none"}),
             }
         }
     
@@ -50,7 +98,48 @@ class ChordLoadModel:
     FUNCTION = "load_model"
     CATEGORY = "Chord"
 
-    def load_model(self, ckpt_name):
+    def build_model(self, ckpt_path, config, ckpt_identity, text_encoder, quantize="none"):
+        """Chord model loaded from the checkpoint and wrapped in a ModelPatcher."""
+        from chord import ChordModel
+        embeddings = None
+        embeddings_identity = text_embeddings_identity(ckpt_identity, config)
+        if text_encoder == "cached_embeddings":
+            embeddings = read_text_embeddings(ckpt_path, embeddings_identity)
+            config.model.stable_diffusion.text_encoder = embeddings is None
+        # safetensors checkpoints are assigned from the memory-mapped file into a meta-device
+        # model, skipping random init and the intermediate state dict copy
+        mmap_load = ckpt_path.endswith(".safetensors")
+        model = ChordModel.empty(config) if mmap_load else ChordModel(config)
+        try:
+            if mmap_load:
+                model.assign_checkpoint(ckpt_path)
+            else:
+                sd = load_torch_file(ckpt_path, safe_load=True)
+                if model.model.sd.text_encoder is None:
+                    sd = {k: v for k, v in sd.items() if ".sd.text_encoder." not in k}
+                model.load_state_dict(sd)
+                del sd
+        except RuntimeError as e:
+            raise RuntimeError('Failed to load model, check if the checkpoint file is correct.\n{}'.format(repr(e)))
+        model.eval()
+        model.ckpt_identity = ckpt_identity
+        if text_encoder == "cached_embeddings":
+            if embeddings is None:
+                embeddings = model.model.text_embedding_state()
+                write_text_embeddings(ckpt_path, embeddings_identity, embeddings)
+                model.model.sd.drop_text_encoder()
+            model.model.load_text_embeddings(embeddings)
+        if quantize != "none":
+            count = model.model.sd.quantize(vae_decoder=quantize == "int8_unet_vae")
+            print(f"[ComfyUI-Chord] Quantised {count} layers to int8 ({quantize})")
+            # quantised results must not share result cache entries with the full-precision model
+            model.ckpt_identity = f"{ckpt_identity}|{quantize}"
+        model_patcher = ModelPatcher(model,
+                                     comfy.model_management.get_torch_device(),
+                                     comfy.model_management.unet_offload_device())
+        return model_patcher
+
+    def load_model(self, ckpt_name, text_encoder="load", quantize="none"):
         try:
             if type(ckpt_name) is list:
                 ckpt_name = ckpt_name[0]
@@ -60,17 +149,27 @@ class ChordLoadModel:
             config_path = os.path.join(os.path.dirname(__file__), "chord/config/chord.yaml")
             if not os.path.exists(config_path):
                 raise FileNotFoundError(f"Config file not found: {config_path}")
+            from omegaconf import OmegaConf
             config = OmegaConf.load(config_path)
-            model = ChordModel(config)
-            sd = load_torch_file(ckpt_path, safe_load=True)
-            try:
-                model.load_state_dict(sd)
-            except RuntimeError as e:
-                raise RuntimeError('Failed to load model, check if the checkpoint file is correct.\n{}'.format(repr(e)))
-            model.eval()
-            model_patcher = ModelPatcher(model,
-                                         comfy.model_management.get_torch_device(),
-                                         comfy.model_management.unet_offload_device())
+            ckpt_identity = file_identity(ckpt_path)
+            if ChordLoadModel.model_cache is None:
+                ChordLoadModel.model_cache = ModelCache(on_evict=release_model_patcher)
+            cache_key = ModelCache.make_key(ckpt_identity, OmegaConf.to_container(config), text_encoder=text_encoder, quantize=quantize)
+            model_patcher = ChordLoadModel.model_cache.get(cache_key)
+            if model_patcher is not None:
+                stats = ChordLoadModel.model_cache.stats()
+                print(f"[ComfyUI-Chord] Reusing loaded model {ckpt_name}, saved a {stats['load_seconds'][cache_key]:.2f}s load")
+                log_model_cache_stats(stats)
+                return (model_patcher,)
+            start = time.perf_counter()
+            # results depend on the resolved config (approxRM search, VAE tiling, CPU dtype, ...)
+            config_hash = ModelCache.make_key("", OmegaConf.to_container(config, resolve=True))
+            model_patcher = self.build_model(ckpt_path, config, ckpt_identity, text_encoder, quantize)
+            model_patcher.model.config_hash = config_hash
+            load_seconds = time.perf_counter() - start
+            ChordLoadModel.model_cache.put(cache_key, model_patcher, load_seconds)
+            print(f"[ComfyUI-Chord] Loaded {ckpt_name} in {load_seconds:.2f}s")
+            log_model_cache_stats(ChordLoadModel.model_cache.stats())
             return (model_patcher,)
         except Exception as e:
             print(f"[ComfyUI-Chord] Error in ChordLoadModel.load_model: {e}")
@@ -81,36 +180,159 @@ class ChordLoadModel:
 class ChordMaterialEstimation:
     """Chord Material Estimation Node"""
 
+    # shared by every node instance so results persist across workflows
+    result_cache = None
+
     @classmethod
     def INPUT_TYPES(cls):
         return {
             "required": {
                 "chord_model": ("CHORD_MODEL",),
                 "image": ("IMAGE",),
+            },
+            "optional": {
+                "use_cache": ("BOOLEAN", {"default": False}),
+                # run the chain on overlapping full-resolution tiles instead of a 1024x1024 resize
+                "tiled": ("BOOLEAN", {"default": False}),
+                "tile_size": ("INT", {"default": 1024, "min": 256, "max": 4096, "step": 64}),
+                "tile_overlap": ("INT", {"default": 256, "min": 0, "max": 2048, "step": 32}),
+                "tile_batch_size": ("INT", {"default": 1, "min": 1, "max": 64}),
+                # images per chain run, 0 picks the largest micro-batch that fits in free device memory
+                "micro_batch_size": ("INT", {"default": 0, "min": 0, "max": 64}),
+                # "circular" keeps the maps tileable, "zeros" suits non-repeating photos
+                "padding": (["circular", "zeros"], {"default": "circular"}),
+                # outputs to compute, the chain stops after the last step they depend on
+                "outputs": (list(cls.OUTPUT_SETS.keys()), {"default": "all"}),
+                # "none" leaves the predictions no later step needs in latent space, for the latent output only
+                "decode": (["per_step", "none"], {"default": "per_step"}),
             }
         }
     
-    RETURN_TYPES = ("IMAGE", "IMAGE", "IMAGE", "IMAGE")
-    RETURN_NAMES = ("basecolor", "normal", "roughness", "metalness")
+    RETURN_TYPES = ("IMAGE", "IMAGE", "IMAGE", "IMAGE", "LATENT")
+    RETURN_NAMES = ("basecolor", "normal", "roughness", "metalness", "latent")
     FUNCTION = "estimate_material"
     CATEGORY = "Chord"
 
-    def estimate_material(self, chord_model, image):
+    # roughness and metalness need the whole chain, so only its prefixes save work
+    OUTPUT_SETS = {
+        "all": None,
+        "basecolor": ("basecolor",),
+        "basecolor+normal": ("basecolor", "normal"),
+    }
+
+    @staticmethod
+    def run_model(model, x, device, outputs=None, decode="per_step"):
+        with torch.no_grad() as no_grad, model.autocast(device) as amp:
+            output = model(x, outputs, decode, return_latents=True)
+        # predicted latents of every chain step stacked along channels, (B, 4 * steps, h / 8, w / 8),
+        # unscaled like every ComfyUI LATENT (the model's latent_format applies the scaling factor)
+        output["latent"] = model.model.sd.unscale_latents(torch.cat(list(output.pop("latents").values()), dim=1))
+        for key in output.keys():
+            if output[key].ndim == 3:
+                output[key] = output[key].unsqueeze(1)
+        return output
+
+    @staticmethod
+    def plan_micro_batch(model, bs, h, w, device, headroom=0.9):
+        """Largest number of h x w images the chain can process at once in the free device memory."""
+        fixed, per_sample = model.model.estimate_sample_memory(h, w)
+        free = comfy.model_management.get_free_memory(device)
+        return max(1, min(bs, int((free * headroom - fixed) // per_sample)))
+
+    @staticmethod
+    def latent_output(latent):
+        """LATENT with the chain steps' latents one after another along the batch: B basecolor, B normal, ..."""
+        return {"samples": latent.unflatten(1, (-1, 4)).transpose(0, 1).flatten(0, 1).contiguous()}
+
+    def run_tiled(self, model, image, device, tile_size, tile_overlap, tile_batch_size, periodic=True, outputs=None, decode="per_step"):
+        """Chord chain on overlapping tiles of the full-resolution image, feather-blended (with wrap-around if periodic)."""
+        from chord.tiling import define_tiles, tile_shape, extract_tiles, feather_weight, add_tile, tile_norm
+        bs, _, h, w = image.shape
+        tile_overlap = min(tile_overlap, tile_size // 2)
+        tiles = define_tiles(h, w, tile_size, tile_overlap, periodic)
+        # without wrap-around, tiles are clipped to a side shorter than tile_size
+        th, tw = tile_shape(h, w, tile_size, periodic)
+        # the latents are blended the same way at 1/8 of the resolution
+        weights = {1: feather_weight((th, tw), tile_overlap, device), 8: feather_weight((th // 8, tw // 8), tile_overlap // 8, device)}
+        jobs = [(b, i) for b in range(bs) for i in range(len(tiles))]
+        output = {}
+        # each tile batch is blended into the accumulators as soon as it is done
+        for start in range(0, len(jobs), tile_batch_size):
+            batch_jobs = jobs[start:start + tile_batch_size]
+            batch = torch.cat([extract_tiles(image[b:b + 1], [tiles[i]], (th, tw)) for b, i in batch_jobs])
+            for key, value in self.run_model(model, batch, device, outputs, decode).items():
+                scale = 8 if key == "latent" else 1
+                if key not in output:
+                    output[key] = torch.zeros((bs, value.shape[1], h // scale, w // scale), device=device)
+                for (b, i), tile_map in zip(batch_jobs, value):
+                    y, x = tiles[i]
+                    add_tile(output[key][b], tile_map.float(), y // scale, x // scale, weights[scale])
+        # all samples share the normaliser of the tiling
+        for key in output:
+            scale = 8 if key == "latent" else 1
+            output[key] /= tile_norm([(y // scale, x // scale) for y, x in tiles], (th // scale, tw // scale),
+                                     h // scale, w // scale, weights[scale])
+        if 'normal' in output:
+            output['normal'] = torch.nn.functional.normalize(2. * output['normal'] - 1., dim=1) / 2. + 0.5
+        return output
+
+    def run_batched(self, model, image, device, micro_batch_size, outputs=None, decode="per_step"):
+        """Chord chain at 1024x1024 over micro-batches, streamed into preallocated outputs at the input size."""
+        bs, _, ori_h, ori_w = image.shape
+        if micro_batch_size <= 0:
+            micro_batch_size = self.plan_micro_batch(model, bs, 1024, 1024, device)
+        num_batches = -(-bs // micro_batch_size)
+        print(f"[ComfyUI-Chord] Processing {bs} image(s) in {num_batches} micro-batch(es) of up to {micro_batch_size}")
+        out_device = comfy.model_management.intermediate_device()
+        output = {}
+        for start in range(0, bs, micro_batch_size):
+            x = resize(image[start:start + micro_batch_size].to(device), (1024, 1024))
+            for key, value in self.run_model(model, x, device, outputs, decode).items():
+                # latents stay at the 1024x1024 working resolution
+                value = value.float() if key == "latent" else resize(value.float(), (ori_h, ori_w))
+                if key not in output:
+                    output[key] = torch.empty((bs, *value.shape[1:]), dtype=value.dtype, device=out_device)
+                output[key][start:start + len(value)] = value
+        return output
+
+    def estimate_material(self, chord_model, image, use_cache=False, tiled=False, tile_size=1024, tile_overlap=256, tile_batch_size=1, micro_batch_size=0, padding="circular", outputs="all", decode="per_step"):
         try:
-            comfy.model_management.load_models_gpu([chord_model])
             model = chord_model.model
+            if use_cache:
+                if ChordMaterialEstimation.result_cache is None:
+                    ChordMaterialEstimation.result_cache = MaterialCache()
+                settings = {"resolution": 1024, "padding": padding, "outputs": outputs, "decode": decode,
+                            "config": getattr(model, "config_hash", ""), "latent": "unscaled"}
+                if tiled:
+                    settings.update(tile_size=tile_size, tile_overlap=tile_overlap)
+                cache_key = MaterialCache.make_key(image, getattr(model, "ckpt_identity", ""), settings)
+                cached = ChordMaterialEstimation.result_cache.get(cache_key)
+                if cached is not None:
+                    return (cached['basecolor'], cached['normal'], cached['roughness'], cached['metalness'], self.latent_output(cached['latent']))
+            comfy.model_management.load_models_gpu([chord_model])
             device = next(model.parameters()).device
-            apply_circular_padding(model)
-            image = image.permute(0,3,1,2).to(device)
+            # no-op unless the previous run on this model used the other mode
+            model.model.sd.set_padding(padding)
+            image = image.permute(0,3,1,2)
             ori_h, ori_w = image.shape[-2:]
-            x = v2.Resize(size=(1024, 1024), antialias=True)(image)
-            with torch.no_grad() as no_grad, torch.autocast(device_type=device.type) as amp:
-                output = model(x)
+            requested = self.OUTPUT_SETS[outputs]
+            if tiled and max(ori_h, ori_w) > tile_size:
+                output = self.run_tiled(model, image.to(device), device, tile_size, tile_overlap, tile_batch_size, padding == "circular", requested, decode)
+            else:
+                output = self.run_batched(model, image, device, micro_batch_size, requested, decode)
+            latent = output.pop("latent")
             for key in output.keys():
-                output[key] = v2.Resize(size=(ori_h, ori_w), antialias=True)(output[key])
-                if output[key].ndim == 4:
+                if output[key].shape[1] == 1:
+                    output[key] = output[key].squeeze(1)
+                else:
                     output[key] = output[key].permute(0,2,3,1)
-            return (output['basecolor'], output['normal'], output['roughness'], output['metalness'])
+            # outputs that were not computed are returned black
+            for key, channels in (("basecolor", (3,)), ("normal", (3,)), ("roughness", ()), ("metalness", ())):
+                if key not in output:
+                    output[key] = torch.zeros((image.shape[0], ori_h, ori_w, *channels), device=comfy.model_management.intermediate_device())
+            if use_cache:
+                ChordMaterialEstimation.result_cache.put(cache_key, {**output, "latent": latent})
+            return (output['basecolor'], output['normal'], output['roughness'], output['metalness'], self.latent_output(latent))
         except Exception as e:
             print(f"[ComfyUI-Chord] Error in ChordMaterialEstimation.estimate_material: {e}")
             import traceback
@@ -125,6 +347,12 @@ class ChordNormalToHeight:
         return {
             "required": {
                 "normal": ("IMAGE",),
+            },
+            "optional": {
+                "solver": (list(POISSON_SOLVERS.keys()), {"default": "fft"}),
+                "mode": (list(HEIGHT_MODES), {"default": "tiled"}),
+                "native_resolution": ("BOOLEAN", {"default": False}),
+                "workers": ("INT", {"default": 1, "min": 1, "max": os.cpu_count() or 1}),
             }
         }
     
@@ -133,20 +361,18 @@ class ChordNormalToHeight:
     FUNCTION = "convert_to_height"
     CATEGORY = "Chord"
 
-    def convert_to_height(self, normal):
+    def convert_to_height(self, normal, solver="fft", mode="tiled", native_resolution=False, workers=1):
         try:
             normal = normal.permute(0,3,1,2)
             height_var_threshold = 5e-4
             ori_h, ori_w = normal.shape[-2:]
-            x = v2.Resize(size=(1024, 1024), antialias=True)(normal)
-            height_maps = []
-            for i in range(x.shape[0]): # to support batch processing
-                height = normal_to_height(x[i])[None, None].squeeze(1)
-                if height.var() < height_var_threshold and height.var() > 0:
-                    height = normal_to_height(x[i], skip_normalize_normal=True)[None, None].squeeze(1)
-                height_maps.append(height)
-            height = torch.cat(height_maps, dim=0)
-            height = v2.Resize(size=(ori_h, ori_w), antialias=True)(height)
+            # native resolution keeps 4K/8K detail, pair it with "tiled_streaming" to bound memory
+            x = normal if native_resolution else resize(normal, (1024, 1024))
+            # pick the normalization path per sample up front so every map is solved once
+            skip_normalize = predict_skip_normalize(x, height_var_threshold)
+            height = normal_to_height(x, skip_normalize_normal=skip_normalize, solver=solver, mode=mode, workers=workers)
+            if not native_resolution:
+                height = resize(height, (ori_h, ori_w))
             return (height,)
         except Exception as e:
             print(f"[ComfyUI-Chord] Error in ChordNormalToHeight.convert_to_height: {e}")
@@ -155,11 +381,6 @@ class ChordNormalToHeight:
             raise
 
 # Node class mappings
-print(f"[ComfyUI-Chord] Debug: Defining NODE_CLASS_MAPPINGS")
-print(f"[ComfyUI-Chord] Debug: ChordLoadModel = {ChordLoadModel}")
-print(f"[ComfyUI-Chord] Debug: ChordMaterialEstimation = {ChordMaterialEstimation}")
-print(f"[ComfyUI-Chord] Debug: ChordNormalToHeight = {ChordNormalToHeight}")
-
 NODE_CLASS_MAPPINGS = {
     "ChordLoadModel": ChordLoadModel,
     "ChordMaterialEstimation": ChordMaterialEstimation,
@@ -172,4 +393,3 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "ChordNormalToHeight": "Chord - Normal to Height",
 }
 
-print(f"[ComfyUI-Chord] Debug: NODE_CLASS_MAPPINGS defined with {len(NODE_CLASS_MAPPINGS)} nodes: {list(NODE_CLASS_MAPPINGS.keys())}")
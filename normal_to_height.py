@@ -1,3 +1,6 @@
+import functools
+import math
+from concurrent.futures import ThreadPoolExecutor
 import torch
 import torch.nn.functional as F
 from torch.signal.windows import hann
@@ -8,25 +11,154 @@ def compute_divergence(fx: torch.tensor, fy: torch.tensor) -> torch.tensor:
     div_y = F.pad(fy[:, 1:, :] - fy[:, :-1, :], (0, 0, 0, 1), mode='constant')
     return div_x + div_y
 
-def solve_poisson_fft(div: torch.tensor, h: int, w: int) -> torch.tensor:
-    fft_div = fft_module.fft2(div)
+def compute_periodic_divergence(fx: torch.tensor, fy: torch.tensor) -> torch.tensor:
+    div_x = torch.roll(fx, -1, dims=-1) - fx
+    div_y = torch.roll(fy, -1, dims=-2) - fy
+    return div_x + div_y
 
-    kx = fft_module.fftfreq(2*w, device=div.device) * 2 * torch.pi
-    ky = fft_module.fftfreq(2*h, device=div.device) * 2 * torch.pi
+SPECTRAL_CACHE_SIZE = 32
+
+@functools.lru_cache(maxsize=SPECTRAL_CACHE_SIZE)
+def poisson_denominator(
+    h: int,
+    w: int,
+    dtype: torch.dtype,
+    device: torch.device,
+    kind: str = "fft",
+) -> torch.tensor:
+    '''
+    Eigenvalues of the negative discrete Laplacian on an h x w grid, laid out
+    like the spectrum of the matching transform ("fft", "rfft" or "dct").
+    '''
+    if kind == "fft":
+        kx = fft_module.fftfreq(w, device=device, dtype=dtype) * 2 * torch.pi
+    elif kind == "rfft":
+        kx = fft_module.rfftfreq(w, device=device, dtype=dtype) * 2 * torch.pi
+    elif kind == "dct":
+        kx = torch.arange(w, device=device, dtype=dtype) * torch.pi / w
+    else:
+        raise ValueError(f"Unknown spectrum kind: {kind}")
+    if kind == "dct":
+        ky = torch.arange(h, device=device, dtype=dtype) * torch.pi / h
+    else:
+        ky = fft_module.fftfreq(h, device=device, dtype=dtype) * 2 * torch.pi
     kx, ky = torch.meshgrid(kx, ky, indexing='xy')
     epsilon = 1e-9
     denom = 4 - 2 * torch.cos(kx) - 2 * torch.cos(ky)
-    denom = torch.where(torch.abs(denom) > epsilon, denom, epsilon) 
+    return torch.where(torch.abs(denom) > epsilon, denom, epsilon)
+
+@functools.lru_cache(maxsize=SPECTRAL_CACHE_SIZE)
+def hann_window_2d(h: int, w: int, dtype: torch.dtype, device: torch.device) -> torch.tensor:
+    return hann(h, device=device, dtype=dtype)[:, None] * hann(w, device=device, dtype=dtype)[None, :]
+
+@functools.lru_cache(maxsize=SPECTRAL_CACHE_SIZE)
+def dct_twiddle(n: int, dtype: torch.dtype, device: torch.device) -> torch.tensor:
+    return torch.exp(-0.5j * torch.pi * torch.arange(n, device=device, dtype=dtype) / n)
+
+@functools.lru_cache(maxsize=SPECTRAL_CACHE_SIZE)
+def dct_permutation(n: int, device: torch.device) -> torch.tensor:
+    # even samples in order followed by odd samples reversed
+    return torch.cat([torch.arange(0, n, 2, device=device), torch.arange(1, n, 2, device=device).flip(0)])
+
+def spectral_cache_info() -> dict:
+    return {
+        "poisson_denominator": poisson_denominator.cache_info(),
+        "hann_window_2d": hann_window_2d.cache_info(),
+        "dct_twiddle": dct_twiddle.cache_info(),
+        "dct_permutation": dct_permutation.cache_info(),
+        "blending_window": blending_window.cache_info(),
+        "blending_norm": blending_norm.cache_info(),
+    }
+
+def clear_spectral_cache() -> None:
+    poisson_denominator.cache_clear()
+    hann_window_2d.cache_clear()
+    dct_twiddle.cache_clear()
+    dct_permutation.cache_clear()
+    blending_window.cache_clear()
+    blending_norm.cache_clear()
+
+def dct(x: torch.tensor, dim: int = -1) -> torch.tensor:
+    '''Unnormalised DCT-II along dim, computed with one length-n FFT (Makhoul).'''
+    x = x.movedim(dim, -1)
+    n = x.shape[-1]
+    v = x[..., dct_permutation(n, x.device)]
+    out = torch.real(fft_module.fft(v) * dct_twiddle(n, x.dtype, x.device))
+    return out.movedim(-1, dim)
 
+def idct(x: torch.tensor, dim: int = -1) -> torch.tensor:
+    '''Inverse of dct() (a scaled DCT-III) along dim.'''
+    x = x.movedim(dim, -1)
+    n = x.shape[-1]
+    # rebuild the hermitian spectrum of the reordered sequence
+    reversed_x = torch.cat([torch.zeros_like(x[..., :1]), x[..., 1:].flip(-1)], dim=-1)
+    spectrum = (x - 1j * reversed_x) * dct_twiddle(n, x.dtype, x.device).conj()
+    v = torch.real(fft_module.ifft(spectrum))
+    out = torch.empty_like(v)
+    out[..., dct_permutation(n, x.device)] = v
+    return out.movedim(-1, dim)
+
+def solve_poisson_fft(div: torch.tensor) -> torch.tensor:
+    h, w = div.shape[-2:]
+    div = F.pad(div, (0, w, 0, h), mode='constant')
+    fft_div = fft_module.fft2(div)
+    denom = poisson_denominator(2*h, 2*w, div.dtype, div.device)
     height_map_full = torch.real(fft_module.ifft2(fft_div / denom))
     return torch.nan_to_num(height_map_full[:, :h, :w])
+
+def solve_poisson_rfft(div: torch.tensor) -> torch.tensor:
+    h, w = div.shape[-2:]
+    div = F.pad(div, (0, w, 0, h), mode='constant')
+    fft_div = fft_module.rfft2(div)
+    denom = poisson_denominator(2*h, 2*w, div.dtype, div.device, "rfft")
+    height_map_full = fft_module.irfft2(fft_div / denom, s=(2*h, 2*w))
+    return torch.nan_to_num(height_map_full[:, :h, :w])
+
+def solve_poisson_dct(div: torch.tensor) -> torch.tensor:
+    # Neumann boundary: the even extension is implicit in the DCT, no padding needed
+    h, w = div.shape[-2:]
+    dct_div = dct(dct(div, dim=-1), dim=-2)
+    denom = poisson_denominator(h, w, div.dtype, div.device, "dct")
+    dct_height = dct_div / denom
+    dct_height[..., 0, 0] = 0
+    return torch.nan_to_num(idct(idct(dct_height, dim=-2), dim=-1))
+
+def solve_poisson_scipy(div: torch.tensor) -> torch.tensor:
+    # CPU alternative to solve_poisson_rfft, scipy's pocketfft releases the GIL
+    # so batches can run concurrently on a thread pool (see map_tile_batches)
+    try:
+        import scipy.fft
+    except ImportError as e:
+        raise ImportError("The \"scipy\" solver requires scipy, install it with `pip install scipy`.") from e
+    h, w = div.shape[-2:]
+    div_np = div.detach().cpu().numpy()
+    fft_div = scipy.fft.rfft2(div_np, s=(2*h, 2*w), workers=1)
+    denom = poisson_denominator(2*h, 2*w, div.dtype, torch.device("cpu"), "rfft").numpy()
+    height_map_full = scipy.fft.irfft2(fft_div / denom, s=(2*h, 2*w), workers=1)
+    return torch.nan_to_num(torch.from_numpy(height_map_full[:, :h, :w]).to(div))
+
+POISSON_SOLVERS = {
+    "fft": solve_poisson_fft,
+    "rfft": solve_poisson_rfft,
+    "dct": solve_poisson_dct,
+    "scipy": solve_poisson_scipy,
+}
+
+def map_tile_batches(fn, batches: list, workers: int = 1) -> list:
+    '''
+    Apply fn to every batch of tile indices, on a thread pool of the given
+    size when workers > 1. Results keep the order of batches.
+    '''
+    if workers <= 1:
+        return [fn(indices) for indices in batches]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, batches))
     
 def apply_window_function(gradient: torch.tensor) -> torch.tensor:
-    hann_window = hann(gradient.shape[-2], device=gradient.device)[:, None] * hann(gradient.shape[-1], device=gradient.device)[None, :]
-    return gradient * hann_window
+    h, w = gradient.shape[-2:]
+    return gradient * hann_window_2d(h, w, gradient.dtype, gradient.device)
     
-def compute_height(normal_map: torch.tensor, epsilon: float = 1e-8) -> torch.tensor:
-    h, w = normal_map.shape[-2:]      
+def compute_height(normal_map: torch.tensor, epsilon: float = 1e-8, solver: str = "fft") -> torch.tensor:
     nz = normal_map[:, 2]
     nz_safe = torch.where(torch.abs(nz) > epsilon, nz, epsilon)
     fx = normal_map[:, 0] / nz_safe
@@ -36,9 +168,30 @@ def compute_height(normal_map: torch.tensor, epsilon: float = 1e-8) -> torch.ten
     fy = apply_window_function(fy)
     
     div = compute_divergence(fx, fy)
-    div = F.pad(div, (0, w, 0, h), mode='constant')
-    height_map = solve_poisson_fft(div, h, w)
-    return height_map - torch.mean(height_map)
+    height_map = POISSON_SOLVERS[solver](div)
+    return height_map - torch.mean(height_map, dim=(-2, -1), keepdim=True)
+
+def compute_periodic_height(normal_map: torch.tensor, epsilon: float = 1e-8) -> torch.tensor:
+    '''
+    Exact Poisson integration of a tileable normal map with one FFT over the
+    whole map, no padding, windowing or tiling.
+
+    Args:
+        normal_map: torch.tensor(B, 3, H, W), normalized normals
+    Returns:
+        torch.tensor(B, H, W), zero-mean height
+    '''
+    h, w = normal_map.shape[-2:]
+    nz = normal_map[:, 2]
+    nz_safe = torch.where(torch.abs(nz) > epsilon, nz, epsilon)
+    fx = normal_map[:, 0] / nz_safe
+    fy = normal_map[:, 1] / nz_safe
+
+    div = compute_periodic_divergence(fx, fy)
+    fft_div = fft_module.rfft2(div)
+    fft_div[..., 0, 0] = 0 # the mean height is free, drop it instead of dividing by ~0
+    denom = poisson_denominator(h, w, div.dtype, div.device, "rfft")
+    return torch.nan_to_num(fft_module.irfft2(fft_div / denom, s=(h, w)))
 
 def extend_normal_map(normal_map: torch.tensor, region_size: int) -> torch.tensor:
     larger_normal_map = F.pad(normal_map, (region_size, region_size, region_size, region_size), mode='circular')
@@ -62,6 +215,33 @@ def define_subregions(
             subregions.append((y, y_end, x, x_end))
     return subregions
 
+def estimate_tile_bytes(h: int, w: int, dtype: torch.dtype = torch.float32, solver: str = "fft") -> int:
+    # divergence (zero-padded to 2h x 2w unless solved with the DCT) plus its
+    # complex spectrum, quotient and inverse
+    padded = h * w if solver == "dct" else 4 * h * w
+    itemsize = torch.finfo(dtype).bits // 8
+    return padded * itemsize * (1 + 2 * 3)
+
+def group_subregions(
+    subregions: list,
+    max_batch_memory: int = 32 * 1024 ** 2,
+    dtype: torch.dtype = torch.float32,
+    solver: str = "fft",
+) -> list:
+    '''
+    Bucket subregion indices by tile shape, then split each bucket into
+    batches whose estimated FFT workspace stays below max_batch_memory.
+    '''
+    buckets = {}
+    for i, (y, y_end, x, x_end) in enumerate(subregions):
+        buckets.setdefault((y_end - y, x_end - x), []).append(i)
+    batches = []
+    for (th, tw), indices in buckets.items():
+        batch_size = max(1, max_batch_memory // estimate_tile_bytes(th, tw, dtype, solver))
+        for i in range(0, len(indices), batch_size):
+            batches.append(indices[i:i + batch_size])
+    return batches
+
 def cosine_smoothing(x: torch.tensor) -> torch.tensor:
     return 0.5 * (1 - torch.cos(torch.pi * x))
 
@@ -72,7 +252,7 @@ def create_subregions(
     results = []
     for region in subregions:
         y, y_end, x, x_end = region
-        sub_map = normal_map[:, y:y_end, x:x_end]
+        sub_map = normal_map[..., y:y_end, x:x_end]
         results.append(sub_map)
     return results
 
@@ -102,6 +282,49 @@ def cosine_blending_update_weight(
         x_smooth = cosine_smoothing(torch.linspace(1, 0, overlap, device=d))
         sub_weight_map[:, -overlap:] *= x_smooth
 
+# a tiling has up to nine distinct windows per tile size, each only a tile large
+@functools.lru_cache(maxsize=4 * SPECTRAL_CACHE_SIZE)
+def blending_window(
+    th: int,
+    tw: int,
+    top: bool,
+    bottom: bool,
+    left: bool,
+    right: bool,
+    device: torch.device,
+) -> torch.tensor:
+    '''
+    Cosine weight of a th x tw tile, ramped on every side that overlaps a
+    neighbour. Shared by all tiles with the same shape and interior sides.
+    '''
+    window = torch.ones((th, tw), device=device)
+    # a stand-in subregion of a 2 x 2 map with the same interior sides
+    subregion = (int(top), 1 if bottom else 2, int(left), 1 if right else 2)
+    cosine_blending_update_weight(window, subregion, (2, 2))
+    return window
+
+def tile_window(subregion, h: int, w: int, device: torch.device) -> torch.tensor:
+    y, y_end, x, x_end = subregion
+    return blending_window(y_end - y, x_end - x, y > 0, y_end < h, x > 0, x_end < w, device)
+
+@functools.lru_cache(maxsize=4)
+def blending_norm(
+    subregions: tuple,
+    h: int,
+    w: int,
+    device: torch.device,
+    epsilon: float = 1e-8,
+) -> torch.tensor:
+    '''
+    Summed tile weights of a tiling, the (h, w) normaliser shared by all calls
+    with the same geometry.
+    '''
+    weight_map = torch.zeros((h, w), device=device)
+    for region in subregions:
+        y, y_end, x, x_end = region
+        weight_map[y:y_end, x:x_end] += tile_window(region, h, w, device)
+    return weight_map + epsilon
+
 def combine_sub_height_maps(
     height_maps: list,
     subregions: list,
@@ -109,56 +332,105 @@ def combine_sub_height_maps(
     w: int,
     epsilon: float = 1e-8,
 ) -> torch.tensor:
-    height_map = torch.zeros((h, w), device=height_maps[0].device)
-    weight_map = torch.zeros((h, w), device=height_maps[0].device)
-
-    for subregion, sub_height_map in zip(subregions, height_maps):
-        y_start, y_end, x_start, x_end = subregion
-        y_slice = slice(y_start, y_end)
-        x_slice = slice(x_start, x_end)
-        
-        sub_weight_map = torch.ones_like(sub_height_map)
-        cosine_blending_update_weight(
-            sub_weight_map,
-            subregion,
-            (h, w)
-        )
-
-        height_map[y_slice, x_slice] += sub_height_map * sub_weight_map
-        weight_map[y_slice, x_slice] += sub_weight_map
-
-    return height_map / (weight_map + epsilon)
+    '''
+    Blend (..., th, tw) tile heights into a (..., h, w) map; any leading
+    batch dimensions are shared by all tiles. Tiles of one shape sit on a
+    regular grid, so each shape is weighted by its separable cosine window
+    and overlap-added with a single F.fold.
+    '''
+    device = height_maps[0].device
+    lead = height_maps[0].shape[:-2]
+    height_map = torch.zeros((math.prod(lead), h, w), device=device)
+    buckets = {}
+    for i, (y, y_end, x, x_end) in enumerate(subregions):
+        buckets.setdefault((y_end - y, x_end - x), []).append(i)
+    for (th, tw), indices in buckets.items():
+        ys = sorted({subregions[i][0] for i in indices})
+        xs = sorted({subregions[i][2] for i in indices})
+        sy = ys[1] - ys[0] if len(ys) > 1 else 1
+        sx = xs[1] - xs[0] if len(xs) > 1 else 1
+        grid = [(y, x) for y in ys for x in xs]
+        if grid != [(subregions[i][0], subregions[i][2]) for i in indices] \
+                or ys != list(range(ys[0], ys[-1] + 1, sy)) or xs != list(range(xs[0], xs[-1] + 1, sx)):
+            # not a regular row-major grid, add the tiles one by one
+            for i in indices:
+                y, y_end, x, x_end = subregions[i]
+                height_map[:, y:y_end, x:x_end] += height_maps[i].reshape(-1, th, tw) * tile_window(subregions[i], h, w, device)
+            continue
+        # a window ramps rows by its top/bottom neighbours and columns by its left/right ones
+        wy = torch.stack([blending_window(th, tw, y > 0, y + th < h, False, False, device)[:, 0] for y in ys])
+        wx = torch.stack([blending_window(th, tw, False, False, x > 0, x + tw < w, device)[0] for x in xs])
+        tiles = torch.stack([height_maps[i] for i in indices], dim=-3).reshape(-1, len(ys), len(xs), th, tw)
+        tiles.mul_(wy[:, None, :, None]).mul_(wx[None, :, None, :])
+        gh, gw = ys[-1] - ys[0] + th, xs[-1] - xs[0] + tw
+        # fold sums the (N, th * tw, L) columns of the grid's tiles into place
+        folded = F.fold(tiles.permute(0, 3, 4, 1, 2).reshape(-1, th * tw, len(ys) * len(xs)),
+                        output_size=(gh, gw), kernel_size=(th, tw), stride=(sy, sx))
+        height_map[:, ys[0]:ys[0] + gh, xs[0]:xs[0] + gw] += folded[:, 0]
+    return height_map.view(*lead, h, w) / blending_norm(tuple(subregions), h, w, device, epsilon)
 
 def crop_height_map(height_map: torch.tensor, original_shape: tuple, region_size: int=128) -> torch.tensor:
     original_height, original_width = original_shape
     return height_map[
+        ...,
         region_size:region_size + original_height,
         region_size:region_size + original_width
     ]
 
 def normalize_height_map(data: torch.tensor, eps: float = 1e-8) -> torch.tensor:
-    return (data - data.min()) / (data.max() - data.min() + eps)
+    # per map, so batched (B, H, W) heights are normalized independently
+    data_min = data.amin(dim=(-2, -1), keepdim=True)
+    data_max = data.amax(dim=(-2, -1), keepdim=True)
+    return (data - data_min) / (data_max - data_min + eps)
 
-def normal_to_height(
-        normal_map: torch.tensor,
-        subdivisions: int = 16,
-        min_region_size: int = 128,
-        skip_normalize_normal: bool = False,
+HEIGHT_MODES = ("tiled", "tiled_streaming", "periodic_global")
+
+def prepare_normal_map(normal_map: torch.tensor, skip_normalize_normal=False) -> torch.tensor:
+    '''
+    Map (B, 3, H, W) normals from [0, 1] to unit vectors, except for the
+    samples flagged in skip_normalize_normal (a bool or a (B,) bool tensor).
+    '''
+    if not torch.is_tensor(skip_normalize_normal):
+        return normal_map if skip_normalize_normal else F.normalize(normal_map * 2.0 - 1.0, dim=1)
+    skip = skip_normalize_normal.to(normal_map.device).view(-1, 1, 1, 1)
+    return torch.where(skip, normal_map, F.normalize(normal_map * 2.0 - 1.0, dim=1))
+
+def predict_skip_normalize(
+    normal_map: torch.tensor,
+    height_var_threshold: float = 5e-4,
+    proxy_size: int = 512,
 ) -> torch.tensor:
     '''
+    Cheap pre-check choosing the normalization path per sample before the
+    full solve: integrate a proxy_size downsampled copy with one global FFT
+    and flag the samples whose normalized height is nearly flat.
+
     Args:
-        normal_map: torch.tensor(1, 3, H, W)
-        subdivisions: int, subdivision level at each edge
-        min_region_size: int, minimal region size
-        skip_normalize_normal: bool, if skip normalization of input normal map
+        normal_map: torch.tensor(B, 3, H, W) in [0, 1]
+    Returns:
+        torch.tensor(B,) bool, True where normalization should be skipped
+    '''
+    h, w = normal_map.shape[-2:]
+    if min(h, w) > proxy_size:
+        normal_map = F.interpolate(normal_map, size=(proxy_size, proxy_size), mode='area')
+    height = normalize_height_map(compute_periodic_height(prepare_normal_map(normal_map)))
+    var = height.var(dim=(-2, -1))
+    return (var < height_var_threshold) & (var > 0)
+
+def compute_tiled_height(
+    normal_map: torch.tensor,
+    subdivisions: int = 16,
+    min_region_size: int = 128,
+    max_batch_memory: int = 32 * 1024 ** 2,
+    solver: str = "fft",
+    workers: int = 1,
+) -> torch.tensor:
+    '''
+    Integrate overlapping windowed subregions of a (B, 3, H, W) normal map and
+    blend them into a (B, H, W) height.
     '''
-    if normal_map.dim() == 4:
-        try: assert normal_map.shape[0] == 1
-        except: breakpoint()
-        normal_map = normal_map.squeeze(0)
+    bs = normal_map.shape[0]
     h, w = normal_map.shape[-2:]
-    if not skip_normalize_normal: 
-        normal_map = F.normalize(normal_map * 2.0 - 1.0, dim=0)
     region_size = min(
         max(min(h, w) // subdivisions, min_region_size),
         min(h, w)
@@ -167,9 +439,135 @@ def normal_to_height(
     lh, lw = larger_normal_map.shape[-2:]
     subregions = define_subregions(lh, lw, region_size)
     map_batch = create_subregions(larger_normal_map, subregions)
-    sub_height_maps = []
-    for m in map_batch:
-        sub_height_maps.append(compute_height(m.unsqueeze(0)).squeeze(0))
+    # solve same-shaped tiles of every sample together, one batched FFT per group
+    def solve(indices):
+        tiles = torch.stack([map_batch[i] for i in indices]).flatten(0, 1)
+        return compute_height(tiles, solver=solver).unflatten(0, (len(indices), bs))
+    batches = group_subregions(subregions, max(1, max_batch_memory // (bs * workers)), normal_map.dtype, solver)
+    sub_height_maps = [None] * len(subregions)
+    for indices, heights in zip(batches, map_tile_batches(solve, batches, workers)):
+        for i, height in zip(indices, heights):
+            sub_height_maps[i] = height
     height_combined = combine_sub_height_maps(sub_height_maps, subregions, lh, lw)
-    height_cropped = crop_height_map(height_combined, (h, w), region_size)
-    return normalize_height_map(height_cropped)
+    return crop_height_map(height_combined, (h, w), region_size)
+
+def stream_tiled_height(
+    normal_map: torch.tensor,
+    skip_normalize_normal=False,
+    subdivisions: int = 16,
+    min_region_size: int = 128,
+    max_batch_memory: int = 32 * 1024 ** 2,
+    solver: str = "fft",
+    workers: int = 1,
+    epsilon: float = 1e-8,
+) -> torch.tensor:
+    '''
+    Memory-bounded equivalent of compute_tiled_height for native-resolution maps.
+    Tiles are cut lazily from the unpadded map with circular indexing and solved
+    one row band at a time. Each band is blended into a rolling accumulator whose
+    rows are written out as soon as no later band overlaps them, so the working
+    set is one band of tiles rather than the padded map plus every tile buffer.
+
+    Args:
+        normal_map: torch.tensor(B, 3, H, W) in [0, 1], normalized per band
+    Returns:
+        torch.tensor(B, H, W), height before min-max normalization
+    '''
+    bs, _, h, w = normal_map.shape
+    device = normal_map.device
+    region_size = min(
+        max(min(h, w) // subdivisions, min_region_size),
+        min(h, w)
+    )
+    lh, lw = h + 2 * region_size, w + 2 * region_size
+    bands = {}
+    for region in define_subregions(lh, lw, region_size):
+        bands.setdefault(region[0], []).append(region)
+    band_starts = sorted(bands)
+
+    height = torch.empty((bs, h, w), device=device)
+    acc = torch.zeros((bs, 0, lw), device=device)
+    weight_acc = torch.zeros((0, lw), device=device)
+    acc_start = 0
+    for b, y in enumerate(band_starts):
+        band = bands[y]
+        y_end = band[0][1]
+        rows = (torch.arange(y, y_end, device=device) - region_size) % h
+        band_map = prepare_normal_map(normal_map.index_select(-2, rows), skip_normalize_normal)
+        grow = y_end - acc_start - acc.shape[1]
+        if grow > 0:
+            acc = torch.cat([acc, torch.zeros((bs, grow, lw), device=device)], dim=1)
+            weight_acc = torch.cat([weight_acc, torch.zeros((grow, lw), device=device)], dim=0)
+        def solve(indices):
+            tiles = torch.stack([
+                band_map.index_select(-1, (torch.arange(band[i][2], band[i][3], device=device) - region_size) % w)
+                for i in indices
+            ]).flatten(0, 1)
+            return compute_height(tiles, solver=solver).unflatten(0, (len(indices), bs))
+        batches = group_subregions(band, max(1, max_batch_memory // (bs * workers)), normal_map.dtype, solver)
+        for indices, heights in zip(batches, map_tile_batches(solve, batches, workers)):
+            for i, sub_height_map in zip(indices, heights):
+                _, _, x, x_end = band[i]
+                sub_weight_map = tile_window(band[i], lh, lw, device)
+                acc[:, y - acc_start:y_end - acc_start, x:x_end] += sub_height_map * sub_weight_map
+                weight_acc[y - acc_start:y_end - acc_start, x:x_end] += sub_weight_map
+        # rows above the next band are final, crop them into the output and drop them
+        next_y = band_starts[b + 1] if b + 1 < len(band_starts) else lh
+        r0, r1 = max(acc_start, region_size), min(next_y, region_size + h)
+        if r1 > r0:
+            rows = slice(r0 - acc_start, r1 - acc_start)
+            cols = slice(region_size, region_size + w)
+            height[:, r0 - region_size:r1 - region_size] = acc[:, rows, cols] / (weight_acc[rows, cols] + epsilon)
+        acc, weight_acc = acc[:, next_y - acc_start:], weight_acc[next_y - acc_start:]
+        acc_start = next_y
+    return height
+
+def normal_to_height(
+        normal_map: torch.tensor,
+        subdivisions: int = 16,
+        min_region_size: int = 128,
+        skip_normalize_normal=False,
+        max_batch_memory: int = 32 * 1024 ** 2,
+        solver: str = "fft",
+        mode: str = "tiled",
+        workers: int = 1,
+) -> torch.tensor:
+    '''
+    Args:
+        normal_map: torch.tensor(3, H, W) or a batch torch.tensor(B, 3, H, W)
+        subdivisions: int, subdivision level at each edge
+        min_region_size: int, minimal region size
+        skip_normalize_normal: bool, if skip normalization of input normal map,
+            or a (B,) bool tensor to choose per sample
+        max_batch_memory: int, upper bound in bytes of the FFT workspace per batched solve
+        solver: str, Poisson solver backend, one of POISSON_SOLVERS
+            ("fft": zero-padded complex FFT, "rfft": zero-padded real FFT,
+            "dct": Neumann boundary DCT without padding, "scipy": CPU scipy.fft)
+        mode: str, "tiled" integrates overlapping windowed subregions and blends them,
+            "tiled_streaming" does the same band by band with memory bounded by one
+            band of tiles (for native-resolution 4K/8K maps),
+            "periodic_global" solves the whole (tileable) map with a single FFT
+        workers: int, number of threads solving tile batches concurrently (tiled modes)
+    Returns:
+        torch.tensor(H, W) normalized height, (B, H, W) for batched input
+    '''
+    if solver not in POISSON_SOLVERS:
+        raise ValueError(f"Unknown solver: {solver}, expected one of {list(POISSON_SOLVERS)}")
+    if mode not in HEIGHT_MODES:
+        raise ValueError(f"Unknown mode: {mode}, expected one of {list(HEIGHT_MODES)}")
+    batched = normal_map.dim() == 4
+    if not batched:
+        normal_map = normal_map.unsqueeze(0)
+    if mode == "tiled_streaming":
+        height = stream_tiled_height(
+            normal_map, skip_normalize_normal, subdivisions, min_region_size, max_batch_memory, solver, workers
+        )
+    elif mode == "periodic_global":
+        height = compute_periodic_height(prepare_normal_map(normal_map, skip_normalize_normal))
+    else:
+        height = compute_tiled_height(
+            prepare_normal_map(normal_map, skip_normalize_normal),
+            subdivisions, min_region_size, max_batch_memory, solver, workers
+        )
+    height = normalize_height_map(height)
+    return height if batched else height.squeeze(0)
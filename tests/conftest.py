@@ -0,0 +1,8 @@
+import os
+import sys
+
+# same import paths as the ComfyUI entry point
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.join(root_dir, "chord"), root_dir):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,57 @@
+import torch
+import torch.nn as nn
+
+from chord.module import make
+from chord.module.chord import Chord
+from chord.util import get_positions, rgb_to_srgb, srgb_to_rgb
+
+# coarse_to_fine may settle on another local minimum of a pixel's roughness, but the
+# mean per-pixel L1 render loss stays within this of the exhaustive optimum
+COARSE_TO_FINE_LOSS_TOLERANCE = 2e-3
+
+def chord(search):
+    # only the approxRM search state of Chord, the diffusion model is not needed
+    model = Chord.__new__(Chord)
+    nn.Module.__init__(model)
+    model.device = torch.device("cpu")
+    model.roughness_step, model.metallic_step = 5., 1.
+    model.approxRM_search, model.approxRM_coarse_stride, model.approxRM_memory_budget = search, 4, 256
+    return model
+
+def scene(bs=2, h=64, w=64):
+    torch.manual_seed(0)
+    normal = nn.functional.normalize(torch.randn(bs, 3, h, w) * 0.3 + torch.tensor([0, 0, 1.])[:, None, None], dim=1)
+    maps = {"basecolor": torch.rand(bs, 3, h, w), "normal": normal * 0.5 + 0.5}
+    light = make("point-light", {"position": [0, 0, 10]})
+    roughness = torch.linspace(0.1, 0.9, w).expand(bs, h, w)[:, None]
+    metallic = (torch.arange(h)[:, None] >= h // 2).float().expand(bs, h, w)[:, None]
+    return maps, light, roughness, metallic
+
+def render(model, maps, light, roughness, metallic):
+    # linear render of (bs, 1, h, w) roughness and metallic maps, (bs, 3, h, w)
+    h, w = roughness.shape[-2:]
+    grid_maps = {key: value[None].permute(0, 1, 3, 4, 2) for key, value in
+                 {**maps, "roughness": roughness, "metallic": metallic}.items()}
+    rgb = model.compute_render(grid_maps, torch.tensor([0, 0, 10.]), get_positions(h, w, 10), light)
+    return rgb[0].permute(0, 3, 1, 2)
+
+def searches(*names):
+    maps, light, roughness, metallic = scene()
+    srgb = rgb_to_srgb(render(chord("exhaustive"), maps, light, roughness, metallic).clamp(0, 1))
+    # the linear target the searches score candidates against
+    target = srgb_to_rgb(srgb)
+    results = {name: chord(name).compute_approxRouMet(srgb, maps, seperate=True, light=light) for name in names}
+    losses = {name: (target - render(chord(name), maps, light, *rm)).abs().sum(1) for name, rm in results.items()}
+    return results, losses
+
+def test_factorized_matches_exhaustive():
+    results, _ = searches("exhaustive", "factorized")
+    for exhaustive, factorized in zip(results["exhaustive"], results["factorized"]):
+        assert torch.equal(factorized, exhaustive)
+
+def test_coarse_to_fine_within_loss_tolerance():
+    _, losses = searches("exhaustive", "coarse_to_fine")
+    excess = losses["coarse_to_fine"] - losses["exhaustive"]
+    # the exhaustive search is the optimum of the grid, no strategy beats it
+    assert excess.min().item() > -1e-5
+    assert excess.mean().item() < COARSE_TO_FINE_LOSS_TOLERANCE
@@ -0,0 +1,27 @@
+import torch
+from diffusers import AutoencoderKL
+
+from chord.module.stable_diffusion import StableDiffusion
+
+class TinyVAE(StableDiffusion):
+    # only the VAE half of StableDiffusion, with a small randomly initialised autoencoder
+    def setup(self):
+        torch.manual_seed(0)
+        self.vae = AutoencoderKL(block_out_channels=(32, 32), down_block_types=("DownEncoderBlock2D",) * 2,
+                                 up_block_types=("UpDecoderBlock2D",) * 2, norm_num_groups=32).eval()
+        self.vae_tile_size = 0
+        self.vae_padding = "zeros"
+
+def comfy_vae_decode(vae, samples):
+    # ComfyUI's VAEDecode hands LATENT samples to the decoder as they are and maps [-1, 1] to [0, 1]
+    return ((vae.decode(samples).sample + 1) / 2).clamp(0, 1)
+
+@torch.no_grad()
+def test_latent_output_decodes_like_comfyui():
+    sd = TinyVAE({})
+    pred_latent = sd.encode_imgs_deterministic(torch.rand(1, 3, 32, 32))
+    samples = sd.unscale_latents(pred_latent)
+    torch.testing.assert_close(comfy_vae_decode(sd.vae, samples), sd.decode_latents(pred_latent))
+    torch.testing.assert_close(samples * sd.vae.config.scaling_factor, pred_latent)
+    # the scaled latents the UNet predicts would decode to something else
+    assert not torch.allclose(comfy_vae_decode(sd.vae, pred_latent), sd.decode_latents(pred_latent), atol=1e-3)
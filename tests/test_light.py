@@ -0,0 +1,30 @@
+import torch
+
+from chord.module import make
+from chord.module.chord import find_light_dir
+from chord.util import get_positions
+
+def irradiance(bs=2, size=96):
+    torch.manual_seed(0)
+    ramp = torch.linspace(0, 1, size)
+    return (ramp[None, None, None, :] + 0.1 * torch.rand(bs, 3, size, size)).clamp(0, 1)
+
+def test_find_light_dir_point_light_prior():
+    prior = make("point-light", {"position": [0, 0, 10]})
+    light = find_light_dir(irradiance(), prior)
+    assert light is not prior
+    assert light.direction.shape == (2, 3)
+    pos = get_positions(32, 32, 10)
+    radiance, direction = light(pos)
+    expected_radiance, expected_direction = prior(pos)
+    torch.testing.assert_close(radiance, expected_radiance)
+    torch.testing.assert_close(direction, expected_direction)
+
+def test_find_light_dir_distant_light_per_sample():
+    prior = make("distant-light", {"direction": [-1.0, -1.0, 1.0]})
+    light = find_light_dir(irradiance(), prior)
+    assert light.direction.shape == (2, 3)
+    assert light.color is prior.color
+    radiance, direction = light(get_positions(32, 32, 10))
+    assert direction.shape == (2, 32, 32, 3)
+    torch.testing.assert_close(direction[0, 0, 0], light.direction[0])
@@ -0,0 +1,28 @@
+import os
+
+import numpy as np
+import torch
+
+from material_cache import MaterialCache
+
+def maps():
+    torch.manual_seed(0)
+    return {"basecolor": torch.rand(1, 8, 8, 3), "roughness": torch.rand(1, 8, 8)}
+
+def test_put_get_round_trip(tmp_path):
+    cache = MaterialCache(str(tmp_path))
+    key = MaterialCache.make_key(torch.zeros(1, 8, 8, 3), "ckpt", {"config": "a"})
+    cache.put(key, maps())
+    fresh = MaterialCache(str(tmp_path))
+    for name, value in fresh.get(key).items():
+        torch.testing.assert_close(value, maps()[name], atol=1e-3, rtol=0)
+
+def test_put_survives_write_errors(tmp_path, monkeypatch, capsys):
+    cache = MaterialCache(str(tmp_path))
+    def fail(*args, **kwargs):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(np, "save", fail)
+    cache.put("key", maps())
+    assert "Could not write material cache entry" in capsys.readouterr().out
+    assert os.listdir(tmp_path) == []
+    assert cache.get("key") is not None
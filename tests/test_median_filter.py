@@ -0,0 +1,22 @@
+import torch
+
+from chord.module.chord import median_filter2d
+
+def radiance(bs=3, size=64):
+    torch.manual_seed(0)
+    return torch.rand(bs, 1, size, size) * 255
+
+def test_histogram_path_matches_rounded_exact_median():
+    x = radiance()
+    exact = median_filter2d(x, 25)
+    histogram = median_filter2d(x, 25, max_patch_elements=0)
+    torch.testing.assert_close(histogram, exact.round(), rtol=0, atol=0)
+
+def test_path_does_not_depend_on_batch_size():
+    # the shipped 64 px irradiance with a 25 px kernel, in a batch large enough to
+    # have switched paths when the limit counted the whole batch
+    x = radiance(bs=32)
+    batched = median_filter2d(x, 25)
+    single = torch.cat([median_filter2d(sample[None], 25) for sample in x])
+    torch.testing.assert_close(batched, single, rtol=0, atol=0)
+    assert not torch.equal(batched, batched.round())
@@ -0,0 +1,12 @@
+from model_cache import ModelCache
+
+def test_stats_track_hits_misses_and_evictions():
+    evicted = []
+    cache = ModelCache(max_models=1, on_evict=evicted.append)
+    first, second = ModelCache.make_key("a", {}), ModelCache.make_key("b", {})
+    assert cache.get(first) is None
+    cache.put(first, "model a", 1.5)
+    assert cache.get(first) == "model a"
+    cache.put(second, "model b", 2.5)
+    assert evicted == ["model a"]
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 1, "models": 1, "load_seconds": {second: 2.5}}
@@ -0,0 +1,103 @@
+import math
+
+import pytest
+import torch
+
+from normal_to_height import (
+    POISSON_SOLVERS,
+    compute_height,
+    compute_tiled_height,
+    cosine_blending_update_weight,
+    crop_height_map,
+    define_subregions,
+    extend_normal_map,
+    normal_to_height,
+)
+
+# the DCT solver imposes Neumann instead of zero-padded boundaries, so it drifts
+# from the FFT reference near the tile edges. On noise the differences average out,
+# on smooth fields whose slope runs across whole tiles they do not. Bounds are in
+# units of the normalized [0, 1] height.
+DCT_TOLERANCE = 2e-3
+DCT_SMOOTH_TOLERANCE = 4e-2
+DCT_SMOOTH_MEAN_TOLERANCE = 1e-2
+
+def normal_map(bs=2, size=256):
+    torch.manual_seed(0)
+    return torch.rand(bs, 3, size, size)
+
+def divergence(bs=3, h=96, w=80):
+    torch.manual_seed(0)
+    return torch.randn(bs, h, w)
+
+@pytest.mark.parametrize("solver", ["rfft", "scipy"])
+def test_solver_matches_fft(solver):
+    if solver == "scipy":
+        pytest.importorskip("scipy")
+    div = divergence()
+    reference = POISSON_SOLVERS["fft"](div)
+    torch.testing.assert_close(POISSON_SOLVERS[solver](div), reference, rtol=0, atol=1e-6 * reference.abs().max().item())
+    reference = normal_to_height(normal_map(), solver="fft")
+    torch.testing.assert_close(normal_to_height(normal_map(), solver=solver), reference, rtol=0, atol=1e-6)
+
+def test_dct_solver_within_tolerance():
+    reference = normal_to_height(normal_map(), solver="fft")
+    height = normal_to_height(normal_map(), solver="dct")
+    assert (height - reference).abs().max().item() < DCT_TOLERANCE
+
+def smooth_normal_map(size, periods):
+    # periodic cosine slopes, normals of a smooth egg-crate height field
+    t = torch.arange(size) / size * 2 * math.pi * periods
+    gx = 0.5 * torch.cos(t)[None, :].expand(size, size)
+    gy = 0.5 * torch.sin(t)[:, None].expand(size, size)
+    normals = torch.nn.functional.normalize(torch.stack([-gx, -gy, torch.ones(size, size)]), dim=0)
+    return normals[None] * 0.5 + 0.5
+
+@pytest.mark.parametrize("size,periods", [(256, 1), (256, 2), (256, 4), (1024, 1)])
+def test_dct_solver_within_tolerance_on_smooth_field(size, periods):
+    normals = smooth_normal_map(size, periods)
+    error = (normal_to_height(normals, solver="dct") - normal_to_height(normals, solver="fft")).abs()
+    assert error.max().item() < DCT_SMOOTH_TOLERANCE
+    assert error.mean().item() < DCT_SMOOTH_MEAN_TOLERANCE
+
+def per_tile_height(normals, subdivisions=16, min_region_size=128):
+    # reference: integrate and blend one tile at a time
+    h, w = normals.shape[-2:]
+    region_size = min(max(min(h, w) // subdivisions, min_region_size), min(h, w))
+    larger = extend_normal_map(normals, region_size)
+    lh, lw = larger.shape[-2:]
+    height = torch.zeros(normals.shape[0], lh, lw)
+    norm = torch.zeros(lh, lw)
+    for subregion in define_subregions(lh, lw, region_size):
+        y, y_end, x, x_end = subregion
+        weight = torch.ones(y_end - y, x_end - x)
+        cosine_blending_update_weight(weight, subregion, (lh, lw))
+        height[:, y:y_end, x:x_end] += compute_height(larger[..., y:y_end, x:x_end]) * weight
+        norm[y:y_end, x:x_end] += weight
+    return crop_height_map(height / (norm + 1e-8), (h, w), region_size)
+
+@pytest.mark.parametrize("max_batch_memory,workers", [(32 * 1024 ** 2, 1), (1, 1), (32 * 1024 ** 2, 2)])
+def test_batched_tiled_matches_per_tile(max_batch_memory, workers):
+    normals = normal_map(size=320)
+    reference = per_tile_height(normals)
+    height = compute_tiled_height(normals, max_batch_memory=max_batch_memory, workers=workers)
+    # fold sums the overlaps in another order than the reference, compare relative to the height range
+    torch.testing.assert_close(height, reference, rtol=0, atol=1e-6 * reference.abs().max().item())
+
+@pytest.mark.parametrize("h,w,skip", [
+    (300, 420, False), (300, 420, "mixed"), (200, 130, True), (200, 130, "mixed"), (257, 383, "mixed"), (1024, 1024, False),
+])
+def test_streaming_matches_tiled(h, w, skip):
+    torch.manual_seed(0)
+    normals = torch.rand(2, 3, h, w)
+    if skip == "mixed":
+        skip = torch.tensor([True, False])
+    tiled = normal_to_height(normals, skip_normalize_normal=skip, mode="tiled")
+    streamed = normal_to_height(normals, skip_normalize_normal=skip, mode="tiled_streaming")
+    torch.testing.assert_close(streamed, tiled, rtol=0, atol=1e-5)
+
+def test_streaming_matches_tiled_unbatched():
+    torch.manual_seed(0)
+    normals = torch.rand(3, 190, 250)
+    torch.testing.assert_close(normal_to_height(normals, mode="tiled_streaming"), normal_to_height(normals, mode="tiled"),
+                               rtol=0, atol=1e-5)
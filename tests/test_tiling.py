@@ -0,0 +1,40 @@
+import pytest
+import torch
+
+from chord.tiling import add_tile, define_tiles, extract_tiles, feather_weight, run_tiled, tile_norm, tile_shape
+
+@pytest.mark.parametrize("periodic", [True, False])
+def test_add_tile_round_trip(periodic):
+    torch.manual_seed(0)
+    image = torch.rand(2, 3, 80, 112)
+    tiles = define_tiles(80, 112, 48, 16, periodic)
+    weight = feather_weight(48, 16)
+    out = torch.zeros_like(image)
+    # samples and tiles in the order ChordMaterialEstimation.run_tiled batches them
+    for b in range(len(image)):
+        for tile_map, (y, x) in zip(extract_tiles(image[b:b + 1], tiles, 48), tiles):
+            add_tile(out[b], tile_map, y, x, weight)
+    torch.testing.assert_close(out / tile_norm(tiles, 48, 80, 112, weight), image)
+
+@pytest.mark.parametrize("periodic", [True, False])
+def test_run_tiled_scaled_output(periodic):
+    torch.manual_seed(0)
+    x = torch.rand(1, 2, 40, 56)
+    # a tile-local fn whose output is twice the input size
+    upsample = lambda t: torch.nn.functional.interpolate(t, scale_factor=2, mode="nearest")
+    torch.testing.assert_close(run_tiled(upsample, x, 16, 8, 2, periodic), upsample(x))
+
+def test_non_periodic_tiles_clip_short_sides():
+    # 64 x 20 with 32 px tiles: the 20 px side must not wrap around
+    columns = torch.arange(20.).expand(1, 1, 64, 20)
+    shape = tile_shape(64, 20, 32, periodic=False)
+    assert shape == (32, 20)
+    tiles = define_tiles(64, 20, 32, 8, periodic=False)
+    for tile in extract_tiles(columns, tiles, shape):
+        torch.testing.assert_close(tile[0, 0], torch.arange(20.))
+    seen = []
+    def fn(t):
+        seen.append(t.shape[-2:])
+        return t
+    torch.testing.assert_close(run_tiled(fn, columns, 32, 8, periodic=False), columns)
+    assert all(s == (32, 20) for s in seen)